@@ -1,4 +1,14 @@
 import iaas.client
+import iaas.concurrency
+import iaas.deadline
+import iaas.diagnostics
 import iaas.enums
 import iaas.exceptions
+import iaas.export
+import iaas.journal
+import iaas.runner
+import iaas.scheduler
+import iaas.sync
+import iaas.tracing
+import iaas.transport
 import iaas.vm
\ No newline at end of file
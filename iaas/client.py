@@ -1,40 +1,50 @@
-from typing import Protocol, List, Optional
+import asyncio
+from typing import AsyncIterator, Iterable, Protocol, List, Optional
 
 from iaas.clients.netcup import NetcupClient
 from iaas.clients.oracle import OracleClient
+from iaas.clients.simulated import SimulatedClient
 from iaas.enums import Providers
-from iaas.vm import VirtualMachine
+from iaas.tracing import span
+from iaas.transport import Transport
+from iaas.vm import VirtualMachine, VmFilter
 
 
 class Client(Protocol):
     """ Used as an interface for all IaaS API clients """
 
-    async def get_all_vms(self) -> list[VirtualMachine]:
+    async def get_all_vms(self, vm_filter: Optional[VmFilter] = None, timeout: Optional[float] = None,
+                          partial: bool = True) -> list[VirtualMachine]:
         ...
 
-    async def stop_vm(self, vm: VirtualMachine) -> str:
+    def iter_vms(self, vm_filter: Optional[VmFilter] = None) -> AsyncIterator[VirtualMachine]:
         ...
 
-    async def force_stop_vm(self, vm: VirtualMachine) -> str:
+    async def stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
         ...
 
-    async def start_vm(self, vm: VirtualMachine) -> str:
+    async def force_stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
         ...
 
-    async def restart_vm(self, vm: VirtualMachine) -> str:
+    async def start_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
         ...
 
-    async def get_public_ips(self, vm: VirtualMachine) -> List[str]:
+    async def restart_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        ...
+
+    async def get_public_ips(self, vm: VirtualMachine, timeout: Optional[float] = None) -> List[str]:
         ...
 
 
 FACTORIES = {
     Providers.ORACLE: OracleClient,
-    Providers.NETCUP: NetcupClient
+    Providers.NETCUP: NetcupClient,
+    Providers.SIMULATED: SimulatedClient
 }
 
 
-def client_factory(provider: Providers, config_path: Optional[str] = None) -> Client:
+def client_factory(provider: Providers, config_path: Optional[str] = None,
+                   transport: Optional[Transport] = None) -> Client:
     """
     Creates an instance of an IaaS provider client. Factory does not maintain any of the instances it creates.
 
@@ -42,6 +52,49 @@ def client_factory(provider: Providers, config_path: Optional[str] = None) -> Cl
 
     :param provider: The required provider for the service you wish to use.
     :param config_path: (Optional) The alternate path to the config file.
+    :param transport: (Optional) The transport used by the client, eg to record or replay provider calls.
     :return: Instance of iaas.client.Client
     """
-    return FACTORIES[provider](config_path)
+    with span("client_factory", provider=provider.name):
+        return FACTORIES[provider](config_path, transport)
+
+
+async def iter_all_vms(clients: Iterable[Client], buffer_size: int = 100,
+                       vm_filter: Optional[VmFilter] = None) -> AsyncIterator[VirtualMachine]:
+    """
+    Merges the iter_vms of several clients into a single async iterator.
+    VMs are yielded as soon as any client returns them, regardless of the provider.
+
+    If any client raises an exception the remaining clients are cancelled and the exception is raised to the caller.
+
+    :param clients: The clients to fetch VMs from.
+    :param buffer_size: The maximum number of VMs held waiting for the caller before the clients are paused.
+    :param vm_filter: (Optional) Only yield VMs matching the filter.
+    :return: An async iterator of iaas.vm.VirtualMachine
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+    finished = object()
+
+    async def pump(client: Client) -> None:
+        try:
+            async for vm in client.iter_vms(vm_filter):
+                await queue.put(vm)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(finished)
+
+    tasks = [asyncio.create_task(pump(client)) for client in clients]
+    running = len(tasks)
+    try:
+        while running:
+            item = await queue.get()
+            if item is finished:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
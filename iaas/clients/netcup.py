@@ -1,12 +1,23 @@
 import asyncio
 import configparser
-from typing import List, Optional
+import logging
+import time
+from typing import AsyncIterator, List, Optional
 
 import iaas.netcup.exceptions as ncws_ex
 from iaas.enums import Providers
 from iaas import exceptions as iaas_ex
+from iaas.concurrency import DEFAULT_MAX_IN_FLIGHT, bounded_as_completed
+from iaas.deadline import deadline, expired
 from iaas.netcup import ncws
-from iaas.vm import VirtualMachine
+from iaas.tracing import span, traced
+from iaas.transport import Transport
+from iaas.vm import VirtualMachine, VmFilter
+
+logger = logging.getLogger(__name__)
+
+# seconds before getVServerInformation is tried again after the webservice reported it as unsupported
+INFORMATION_REPROBE_INTERVAL = 3600.0
 
 
 def set_config_path(path: Optional[str]) -> str:
@@ -28,33 +39,69 @@ class NetcupClient:
     Client uses bespoke Netcup SOAP API located in the iaas.netcup directory.
     """
 
-    def __init__(self, path: Optional[str] = None):
+    def __init__(self, path: Optional[str] = None, transport: Optional[Transport] = None):
         self._config_path = set_config_path(path)
+        self._transport = transport
+        self._information_disabled_until = 0.0
         self._config = configparser.ConfigParser()
-        self._config.read(self._config_path)
+        with span("netcup.config", path=self._config_path):
+            self._config.read(self._config_path)
+        self._timeout = self._config.getfloat(section="DEFAULT", option="timeout", fallback=ncws.DEFAULT_TIMEOUT)
+        self._max_in_flight = self._config.getint(section="DEFAULT", option="maxInFlight",
+                                                  fallback=DEFAULT_MAX_IN_FLIGHT)
 
-    async def get_all_vms(self) -> list[VirtualMachine]:
+    @traced("netcup.get_all_vms")
+    async def get_all_vms(self, vm_filter: Optional[VmFilter] = None, timeout: Optional[float] = None,
+                          partial: bool = True) -> list[VirtualMachine]:
         """
         Returns a list of VMs.
 
+        If the timeout or an outer iaas.deadline is reached the VMs fetched so far are returned,
+        unless partial is False in which case iaas.exceptions.DeadlineExceeded is raised.
+        A VM whose lookup reaches the per call timeout before then is skipped and logged. If getVServers
+        reaches the per call timeout DeadlineExceeded is raised, as the fleet is not known.
+
+        :param vm_filter: (Optional) Only return VMs matching the filter.
+        :param timeout: (Optional) Seconds allowed for the whole listing.
+        :param partial: (Optional) Return the VMs fetched so far if the deadline is reached.
         :return: A list of iaas.vm.VirtualMachine
         """
-        login = self._config.get(section="DEFAULT", option="loginName")
-        password = self._config.get(section="DEFAULT", option="password")
         vm_list = []
-        try:
-            vm_id_list = await ncws.get_v_servers(login, password)
+        with deadline(timeout):
+            try:
+                async for vm in self.iter_vms(vm_filter):
+                    vm_list.append(vm)
+            except iaas_ex.DeadlineExceeded as de:
+                # a per call timeout is not the end of the operation, only return part of the list at the deadline
+                if not partial or not expired():
+                    raise
+                logger.warning(f"Returning {len(vm_list)} Netcup VMs, listing did not complete - {de.message}")
 
-            for vm_id in vm_id_list:
-                display_name, state = await asyncio.gather(
-                    ncws.get_v_server_nickname(login, password, vm_id),
-                    ncws.get_v_server_state(login, password, vm_id)
-                )
+        return vm_list
 
-                vm = VirtualMachine(vm_id=vm_id, display_name=display_name, state=state, provider=Providers.NETCUP)
-                vm_list.append(vm)
+    async def iter_vms(self, vm_filter: Optional[VmFilter] = None) -> AsyncIterator[VirtualMachine]:
+        """
+        Yields each VM as soon as its details have been returned by the webservice.
+        VMs are yielded in the order the lookups complete and not the order returned by getVServers.
+        At most maxInFlight lookups from the config file run at once, so memory does not grow with the fleet.
+
+        The webservice has no filtering so the filter is used to skip the detail calls for VMs that cannot match.
 
-            return vm_list
+        :param vm_filter: (Optional) Only yield VMs matching the filter.
+        :return: An async iterator of iaas.vm.VirtualMachine
+        """
+        vm_filter = vm_filter if vm_filter else VmFilter()
+        login = self._config.get(section="DEFAULT", option="loginName")
+        password = self._config.get(section="DEFAULT", option="password")
+        try:
+            vm_id_list = await ncws.get_v_servers(login, password, timeout=self._timeout,
+                                                 transport=self._transport)
+            lookups = (self._lookup_vm(login, password, vm_id, vm_filter)
+                       for vm_id in vm_id_list if vm_filter.match_id(vm_id))
+
+            async for vm in bounded_as_completed(lookups, self._max_in_flight):
+                if vm is not None:
+                    yield vm
 
         except ncws_ex.ValidationException as ve:
             raise iaas_ex.ClientException(
@@ -65,93 +112,184 @@ class NetcupClient:
         except ncws_ex.ServiceException as se:
             raise iaas_ex.ProviderError(f"Netcup API error returned when getting list of VMs - {se.message}") from None
 
-    async def stop_vm(self, vm: VirtualMachine) -> str:
+    async def _lookup_vm(self, login: str, password: str, vm_id: str,
+                         vm_filter: VmFilter) -> Optional[VirtualMachine]:
+        """
+        Builds the VM, skipping it if a request reaches the per call timeout before the operation deadline.
+
+        :param login: The account login name.
+        :param password: The webservice password.
+        :param vm_id: The VM name and not the nickname.
+        :param vm_filter: Only create the VM if it matches the filter.
+        :return: iaas.vm.VirtualMachine. None if the VM does not match the filter or timed out.
+        """
+        try:
+            return await self._build_vm(login, password, vm_id, vm_filter)
+        except iaas_ex.DeadlineExceeded as de:
+            if expired():
+                raise
+            logger.warning(f"Skipping Netcup VM {vm_id}, the lookup timed out - {de.message}")
+            return None
+
+    @traced("netcup.build_vm")
+    async def _build_vm(self, login: str, password: str, vm_id: str,
+                        vm_filter: VmFilter) -> Optional[VirtualMachine]:
+        """
+        Fetches the details for a single VM and creates the VirtualMachine instance.
+
+        Uses the getVServerInformation endpoint to get the nickname, state and IPs in one request.
+        If the request fails the nickname and state are fetched individually for this VM, and the nickname
+        is not fetched if the state does not match the filter. If the webservice reports the endpoint as
+        unsupported it is not used again until INFORMATION_REPROBE_INTERVAL has passed.
+
+        :param login: The account login name.
+        :param password: The webservice password.
+        :param vm_id: The VM name and not the nickname.
+        :param vm_filter: Only create the VM if it matches the filter.
+        :return: iaas.vm.VirtualMachine. None if the VM does not match the filter.
+        """
+        if time.monotonic() >= self._information_disabled_until:
+            try:
+                information = await ncws.get_v_server_information(login, password, vm_id, timeout=self._timeout,
+                                                                  transport=self._transport)
+                if not (vm_filter.match_state(information["state"]) and vm_filter.match_name(information["nickname"])):
+                    return None
+                with span("vm.create"):
+                    return VirtualMachine(vm_id=vm_id, display_name=information["nickname"],
+                                          state=information["state"], provider=Providers.NETCUP,
+                                          public_ips=information["ips"])
+            except ncws_ex.ServiceException as se:
+                if ncws.is_unsupported_operation(se):
+                    self._information_disabled_until = time.monotonic() + INFORMATION_REPROBE_INTERVAL
+                    logger.warning(f"Netcup getVServerInformation not available, using individual calls - "
+                                   f"{se.message}")
+                else:
+                    logger.debug(f"Netcup getVServerInformation failed for {vm_id}, using individual calls - "
+                                 f"{se.message}")
+
+        if vm_filter.states is not None:
+            state = await ncws.get_v_server_state(login, password, vm_id, timeout=self._timeout,
+                                                  transport=self._transport)
+            if not vm_filter.match_state(state):
+                return None
+            display_name = await ncws.get_v_server_nickname(login, password, vm_id, timeout=self._timeout,
+                                                            transport=self._transport)
+        else:
+            display_name, state = await asyncio.gather(
+                ncws.get_v_server_nickname(login, password, vm_id, timeout=self._timeout, transport=self._transport),
+                ncws.get_v_server_state(login, password, vm_id, timeout=self._timeout, transport=self._transport)
+            )
+
+        if not vm_filter.match_name(display_name):
+            return None
+
+        with span("vm.create"):
+            return VirtualMachine(vm_id=vm_id, display_name=display_name, state=state, provider=Providers.NETCUP)
+
+    @traced("netcup.stop_vm")
+    async def stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
         """
         Stops the supplied VM.
 
         :param vm: A virtual machine
+        :param timeout: (Optional) Seconds allowed for the call.
         :return: The result from the webservice call
         """
-        try:
-            result = await ncws.v_server_acpi_shutdown(self._config.get(section="DEFAULT", option="loginName"),
-                                                       self._config.get(section="DEFAULT", option="password"),
-                                                       vm.vm_id)
-            return result
-        except ncws_ex.ServiceException as se:
-            raise iaas_ex.ProviderError(f"Error returned from Netcup API when stopping VM - {se.message}") from None
-        except ncws_ex.ValidationException as ve:
-            raise iaas_ex.ProviderError(
-                f"Netcup API error stopping VM. Check that login details are correct - {ve.message}") from None
+        with deadline(timeout):
+            try:
+                result = await ncws.v_server_acpi_shutdown(self._config.get(section="DEFAULT", option="loginName"),
+                                                           self._config.get(section="DEFAULT", option="password"),
+                                                           vm.vm_id, timeout=self._timeout, transport=self._transport)
+                return result
+            except ncws_ex.ServiceException as se:
+                raise iaas_ex.ProviderError(f"Error returned from Netcup API when stopping VM - {se.message}") from None
+            except ncws_ex.ValidationException as ve:
+                raise iaas_ex.ProviderError(
+                    f"Netcup API error stopping VM. Check that login details are correct - {ve.message}") from None
 
-    async def force_stop_vm(self, vm: VirtualMachine) -> str:
+    @traced("netcup.force_stop_vm")
+    async def force_stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
         """
         Force stop the supplied VM.
 
         :param vm: A virtual machine
+        :param timeout: (Optional) Seconds allowed for the call.
         :return: The result from the webservice call
         """
-        try:
-            result = await ncws.v_server_power_off(self._config.get(section="DEFAULT", option="loginName"),
-                                                   self._config.get(section="DEFAULT", option="password"),
-                                                   vm.vm_id)
-            return result
-        except ncws_ex.ServiceException as se:
-            raise iaas_ex.ProviderError(f"Error returned from Netcup API when stopping VM - {se.message}") from None
-        except ncws_ex.ValidationException as ve:
-            raise iaas_ex.ProviderError(
-                f"Netcup API error stopping VM. Check that login details are correct - {ve.message}") from None
+        with deadline(timeout):
+            try:
+                result = await ncws.v_server_power_off(self._config.get(section="DEFAULT", option="loginName"),
+                                                       self._config.get(section="DEFAULT", option="password"),
+                                                       vm.vm_id, timeout=self._timeout, transport=self._transport)
+                return result
+            except ncws_ex.ServiceException as se:
+                raise iaas_ex.ProviderError(f"Error returned from Netcup API when stopping VM - {se.message}") from None
+            except ncws_ex.ValidationException as ve:
+                raise iaas_ex.ProviderError(
+                    f"Netcup API error stopping VM. Check that login details are correct - {ve.message}") from None
 
-    async def start_vm(self, vm: VirtualMachine) -> str:
+    @traced("netcup.start_vm")
+    async def start_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
         """
         Starts the supplied VM.
 
         :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
         :return: The result from the webservice call.
         """
-        try:
-            result = await ncws.v_server_start(self._config.get(section="DEFAULT", option="loginName"),
-                                               self._config.get(section="DEFAULT", option="password"),
-                                               vm.vm_id)
-            return result
-        except ncws_ex.ServiceException as se:
-            raise iaas_ex.ProviderError(f"Error returned from Netcup API when starting VM - {se.message}") from None
-        except ncws_ex.ValidationException as ve:
-            raise iaas_ex.ProviderError(
-                f"Netcup API error starting VM. Check that login details are correct - {ve.message}") from None
+        with deadline(timeout):
+            try:
+                result = await ncws.v_server_start(self._config.get(section="DEFAULT", option="loginName"),
+                                                   self._config.get(section="DEFAULT", option="password"),
+                                                   vm.vm_id, timeout=self._timeout, transport=self._transport)
+                return result
+            except ncws_ex.ServiceException as se:
+                raise iaas_ex.ProviderError(f"Error returned from Netcup API when starting VM - {se.message}") from None
+            except ncws_ex.ValidationException as ve:
+                raise iaas_ex.ProviderError(
+                    f"Netcup API error starting VM. Check that login details are correct - {ve.message}") from None
 
-    async def restart_vm(self, vm: VirtualMachine) -> str:
+    @traced("netcup.restart_vm")
+    async def restart_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
         """
         Restarts the supplied VM.
 
         :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
         :return: The result from the webservice call.
         """
-        try:
-            result = await ncws.v_server_acpi_reboot(self._config.get(section="DEFAULT", option="loginName"),
-                                                     self._config.get(section="DEFAULT", option="password"),
-                                                     vm.vm_id)
-            return result
-        except ncws_ex.ServiceException as se:
-            raise iaas_ex.ProviderError(f"Error returned from Netcup API when restarting VM - {se.message}") from None
-        except ncws_ex.ValidationException as ve:
-            raise iaas_ex.ProviderError(
-                f"Netcup API error restarting VM. Check that login details are correct - {ve.message}") from None
+        with deadline(timeout):
+            try:
+                result = await ncws.v_server_acpi_reboot(self._config.get(section="DEFAULT", option="loginName"),
+                                                         self._config.get(section="DEFAULT", option="password"),
+                                                         vm.vm_id, timeout=self._timeout, transport=self._transport)
+                return result
+            except ncws_ex.ServiceException as se:
+                raise iaas_ex.ProviderError(
+                    f"Error returned from Netcup API when restarting VM - {se.message}") from None
+            except ncws_ex.ValidationException as ve:
+                raise iaas_ex.ProviderError(
+                    f"Netcup API error restarting VM. Check that login details are correct - {ve.message}") from None
 
-    async def get_public_ips(self, vm: VirtualMachine) -> List[str]:
+    @traced("netcup.get_public_ips")
+    async def get_public_ips(self, vm: VirtualMachine, timeout: Optional[float] = None) -> List[str]:
         """
         Returns a list of IPs for the supplied VM.
 
         :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
         :return: A list of IPs.
         """
-        try:
-            ip_list = await ncws.get_v_server_ips(self._config.get(section="DEFAULT", option="loginName"),
-                                                  self._config.get(section="DEFAULT", option="password"),
-                                                  vm.vm_id)
-            return ip_list
-        except ncws_ex.ServiceException as se:
-            raise iaas_ex.ProviderError(
-                f"Error returned from Netcup API when getting list of IPs - {se.message}") from None
-        except ncws_ex.ValidationException as ve:
-            raise iaas_ex.ProviderError(
-                f"Netcup API error getting list of IPs. Check that login details are correct -{ve.message}") from None
+        with deadline(timeout):
+            try:
+                ip_list = await ncws.get_v_server_ips(self._config.get(section="DEFAULT", option="loginName"),
+                                                      self._config.get(section="DEFAULT", option="password"),
+                                                      vm.vm_id, timeout=self._timeout, transport=self._transport)
+                return ip_list
+            except ncws_ex.ServiceException as se:
+                raise iaas_ex.ProviderError(
+                    f"Error returned from Netcup API when getting list of IPs - {se.message}") from None
+            except ncws_ex.ValidationException as ve:
+                raise iaas_ex.ProviderError(
+                    f"Netcup API error getting list of IPs. "
+                    f"Check that login details are correct -{ve.message}") from None
@@ -1,13 +1,30 @@
-from typing import List, Optional
+import functools
+import logging
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Callable, List, Optional
 
 import oci
 from oci.core import ComputeClient, VirtualNetworkClient
 from oci.core.models import instance
 from oci.exceptions import InvalidConfig, ConfigFileNotFound, InvalidKeyFilePath, ServiceError
+from oci.response import Response
+from oci.util import to_dict
 
 from iaas.enums import Providers
 from iaas import exceptions as iaas_ex
-from vm import VirtualMachine
+from iaas.concurrency import DEFAULT_MAX_IN_FLIGHT, bounded_as_completed
+from iaas.deadline import deadline, expired
+from iaas.journal import current_retry_token
+from iaas.tracing import span, traced
+from iaas.transport import DEFAULT_TRANSPORT, Transport
+from iaas.vm import VirtualMachine, VmFilter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30.0
+
+# VM states that have the same name as an OCI lifecycle state so can be passed to list_instances
+ORACLE_STATES = {"RUNNING", "STOPPED"}
 
 
 def set_config_path(path: Optional[str]) -> str:
@@ -39,6 +56,62 @@ def oracle_vm_factory(vm: instance) -> VirtualMachine:
     )
 
 
+def instance_matches(vm: instance, vm_filter: VmFilter) -> bool:
+    """
+    Checks an instance against the filter before a VirtualMachine is created for it.
+
+    :param vm: oci.core.models.instance
+    :param vm_filter: The filter to check against.
+    :return: True if the instance matches.
+    """
+    return (vm_filter.match_id(vm.id)
+            and vm_filter.match_state(vm.lifecycle_state)
+            and vm_filter.match_name(vm.display_name))
+
+
+def retry_token_kwargs() -> dict[str, str]:
+    """
+    Returns the opc_retry_token for an OCI request if the call is being run through an iaas.journal.
+
+    :return: The keyword arguments to add to the request.
+    """
+    token = current_retry_token()
+    return {"opc_retry_token": token} if token else {}
+
+
+def encode_response(response: Response) -> dict[str, Any]:
+    """
+    Converts an OCI SDK response into plain data so it can be recorded by a transport.
+
+    :param response: oci.response.Response
+    :return: A dictionary of the response status, paging and data.
+    """
+    return {"status": response.status,
+            "next_page": response.next_page,
+            "data": to_dict(response.data)}
+
+
+def decode_response(payload: dict[str, Any]) -> SimpleNamespace:
+    """
+    Rebuilds a recorded response. The data models are replaced with namespaces that have the same attributes.
+
+    :param payload: A response created by encode_response.
+    :return: An object with the same attributes as oci.response.Response used by the client.
+    """
+
+    def to_namespace(value: Any) -> Any:
+        if isinstance(value, dict):
+            return SimpleNamespace(**{key: to_namespace(item) for key, item in value.items()})
+        if isinstance(value, list):
+            return [to_namespace(item) for item in value]
+        return value
+
+    return SimpleNamespace(status=payload["status"],
+                           next_page=payload["next_page"],
+                           has_next_page=payload["next_page"] is not None,
+                           data=to_namespace(payload["data"]))
+
+
 class OracleClient:
     """
     Oracle Cloud client.
@@ -49,12 +122,16 @@ class OracleClient:
 
     """
 
-    def __init__(self, path: Optional[str] = None):
+    def __init__(self, path: Optional[str] = None, transport: Optional[Transport] = None):
+        self._transport = transport if transport else DEFAULT_TRANSPORT
         try:
             self._config_path = set_config_path(path)
-            self._config = oci.config.from_file(file_location=self._config_path)
-            oci.config.validate_config(self._config)
-            self._compute_client = ComputeClient(self._config)
+            with span("oracle.config", path=self._config_path):
+                self._config = oci.config.from_file(file_location=self._config_path)
+                oci.config.validate_config(self._config)
+            self._timeout = float(self._config.get("timeout", DEFAULT_TIMEOUT))
+            self._max_in_flight = int(self._config.get("max_in_flight", DEFAULT_MAX_IN_FLIGHT))
+            self._compute_client = ComputeClient(self._config, timeout=self._timeout)
         except InvalidConfig as v:
             raise iaas_ex.ClientException(f"Config in {self._config_path} is not valid") from None
         except ConfigFileNotFound as c:
@@ -62,78 +139,196 @@ class OracleClient:
         except InvalidKeyFilePath as k:
             raise iaas_ex.ClientException(f"Unable to locate .pem file specified in {self._config_path}") from None
 
-    async def get_all_vms(self) -> list[VirtualMachine]:
+    @traced("oracle.get_all_vms")
+    async def get_all_vms(self, vm_filter: Optional[VmFilter] = None, timeout: Optional[float] = None,
+                          partial: bool = True) -> list[VirtualMachine]:
         """
         Returns a list of VirtualMachine class instances.
 
+        If the timeout or an outer iaas.deadline is reached the VMs fetched so far are returned,
+        unless partial is False in which case iaas.exceptions.DeadlineExceeded is raised.
+        If a request reaches the per call timeout before then DeadlineExceeded is raised, except when fetching
+        VMs by id where the VM is skipped and logged.
+
+        :param vm_filter: (Optional) Only return VMs matching the filter.
+        :param timeout: (Optional) Seconds allowed for the whole listing.
+        :param partial: (Optional) Return the VMs fetched so far if the deadline is reached.
         :return: A list of iaas.vm.VirtualMachine
         """
+        vm_list = []
+        with deadline(timeout):
+            try:
+                async for vm in self.iter_vms(vm_filter):
+                    vm_list.append(vm)
+            except iaas_ex.DeadlineExceeded as de:
+                # a per call timeout is not the end of the operation, only return part of the list at the deadline
+                if not partial or not expired():
+                    raise
+                logger.warning(f"Returning {len(vm_list)} Oracle VMs, listing did not complete - {de.message}")
+
+        return vm_list
+
+    async def iter_vms(self, vm_filter: Optional[VmFilter] = None) -> AsyncIterator[VirtualMachine]:
+        """
+        Yields VirtualMachine class instances as each page of instances is returned by the API.
+        Only a single page of instances is held in memory at any one time.
+
+        A single state or a name without wildcards is passed to list_instances so only matching instances are
+        returned by the API. If VM ids are given each instance is fetched directly instead of listing them all.
+
+        :param vm_filter: (Optional) Only yield VMs matching the filter.
+        :return: An async iterator of iaas.vm.VirtualMachine
+        """
+        vm_filter = vm_filter if vm_filter else VmFilter()
         try:
-            vm_instances = self._compute_client.list_instances(compartment_id=self._config["tenancy"]).data
-            return [oracle_vm_factory(vm) for vm in vm_instances]
+            if vm_filter.vm_ids is not None:
+                async for vm in self._iter_vms_by_id(vm_filter):
+                    yield vm
+                return
+
+            list_kwargs = {"compartment_id": self._config["tenancy"]}
+            if vm_filter.states is not None and len(vm_filter.states) == 1:
+                state = next(iter(vm_filter.states))
+                if state in ORACLE_STATES:
+                    list_kwargs["lifecycle_state"] = state
+            if vm_filter.exact_name is not None:
+                list_kwargs["display_name"] = vm_filter.exact_name
+
+            next_page = None
+            while True:
+                page = await self._call(self._compute_client.list_instances, page=next_page, **list_kwargs)
+                with span("vm.create", count=len(page.data)):
+                    vm_list = [oracle_vm_factory(vm) for vm in page.data if instance_matches(vm, vm_filter)]
+                for vm in vm_list:
+                    yield vm
+
+                if not page.has_next_page:
+                    break
+                next_page = page.next_page
         except ServiceError as e:
             raise iaas_ex.ProviderError(
                 f"Oracle API return an error when fetching list of VMs - {e.message}") from None
 
-    async def stop_vm(self, vm: VirtualMachine) -> str:
+    async def _iter_vms_by_id(self, vm_filter: VmFilter) -> AsyncIterator[VirtualMachine]:
+        """
+        Fetches each instance in the filter by id, at most max_in_flight at once. Instances that no longer exist
+        are skipped.
+
+        :param vm_filter: The filter containing the VM ids.
+        :return: An async iterator of iaas.vm.VirtualMachine
+        """
+
+        async def get_instance(vm_id: str) -> Optional[instance]:
+            try:
+                return (await self._call(self._compute_client.get_instance, vm_id)).data
+            except ServiceError as e:
+                if e.status == 404:
+                    return None
+                raise
+            except iaas_ex.DeadlineExceeded as de:
+                if expired():
+                    raise
+                logger.warning(f"Skipping Oracle VM {vm_id}, the lookup timed out - {de.message}")
+                return None
+
+        lookups = (get_instance(vm_id) for vm_id in vm_filter.vm_ids)
+        async for vm in bounded_as_completed(lookups, self._max_in_flight):
+            if vm is not None and instance_matches(vm, vm_filter):
+                yield oracle_vm_factory(vm)
+
+    @traced("oracle.stop_vm")
+    async def stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
         """
         Gracefully shuts down the instance by sending a shutdown command to the operating system.
 
         :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
         :return: The vm state.
         """
+        with deadline(timeout):
+            vm_instance = await self._call(self._compute_client.instance_action, vm.vm_id, action="SOFTSTOP",
+                                           **retry_token_kwargs())
+            return vm_instance.data.lifecycle_state
 
-        vm_instance = self._compute_client.instance_action(vm.vm_id, action="SOFTSTOP")
-        return vm_instance.data.lifecycle_state
-
-    async def force_stop_vm(self, vm: VirtualMachine) -> str:
+    @traced("oracle.force_stop_vm")
+    async def force_stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
         """
         Power off the VM instance.
 
         :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
         :return: The vm state.
         """
+        with deadline(timeout):
+            vm_instance = await self._call(self._compute_client.instance_action, vm.vm_id, action="STOP",
+                                           **retry_token_kwargs())
+            return vm_instance.data.lifecycle_state
 
-        vm_instance = self._compute_client.instance_action(vm.vm_id, action="STOP")
-        return vm_instance.data.lifecycle_state
-
-    async def start_vm(self, vm: VirtualMachine) -> str:
+    @traced("oracle.start_vm")
+    async def start_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
         """
         Starts the supplied VM instance.
 
         :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
         :return: The vm state.
         """
+        with deadline(timeout):
+            vm_instance = await self._call(self._compute_client.instance_action, vm.vm_id, action="START",
+                                           **retry_token_kwargs())
+            return vm_instance.data.lifecycle_state
 
-        vm_instance = self._compute_client.instance_action(vm.vm_id, action="START")
-        return vm_instance.data.lifecycle_state
-
-    async def restart_vm(self, vm: VirtualMachine) -> str:
+    @traced("oracle.restart_vm")
+    async def restart_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
         """
         Restarts the supplied VM instance.
 
         :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
         :return: The vm state.
         """
+        with deadline(timeout):
+            vm_instance = await self._call(self._compute_client.instance_action, vm.vm_id, action="SOFTRESET",
+                                           **retry_token_kwargs())
+            return vm_instance.data.lifecycle_state
 
-        vm_instance = self._compute_client.instance_action(vm.vm_id, action="SOFTRESET")
-        return vm_instance.data.lifecycle_state
-
-    async def get_public_ips(self, vm: VirtualMachine) -> List[str]:
+    @traced("oracle.get_public_ips")
+    async def get_public_ips(self, vm: VirtualMachine, timeout: Optional[float] = None) -> List[str]:
         """
         Returns a list of all public IP addresses assigned to the VM instance.
 
         :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
         :return: A list of IPs.
         """
+        with deadline(timeout):
+            virtual_network_client = VirtualNetworkClient(self._config, timeout=self._timeout)
 
-        virtual_network_client = VirtualNetworkClient(self._config)
+            vnic_attachments = (await self._call(
+                self._compute_client.list_vnic_attachments,
+                compartment_id=self._config["tenancy"],
+                instance_id=vm.vm_id
+            )).data
 
-        vnic_attachments = self._compute_client.list_vnic_attachments(
-            compartment_id=self._config["tenancy"],
-            instance_id=vm.vm_id
-        ).data
+            # get a list of vNICs from the vNIC attachment. Possible to have multiple.
+            vnics = [(await self._call(virtual_network_client.get_vnic, va.vnic_id)).data for va in vnic_attachments]
+            return [vnic.public_ip for vnic in vnics if vnic.public_ip]
 
-        # get a list of vNICs from the vNIC attachment. Possible to have multiple.
-        vnics = [virtual_network_client.get_vnic(va.vnic_id).data for va in vnic_attachments]
-        return [vnic.public_ip for vnic in vnics if vnic.public_ip]
+    async def _call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Makes a blocking OCI SDK call through the transport, bounded by the client timeout and the current
+        iaas.deadline.
+
+        :param func: The OCI SDK function.
+        :return: The result of the SDK call.
+        """
+        # retry tokens are unique per action so are left out of the parameters that identify the request
+        params = {key: value for key, value in kwargs.items() if key != "opc_retry_token"}
+        if args:
+            params["args"] = list(args)
+        with span(f"oci.{func.__name__}"):
+            return await self._transport.call("oracle", func.__name__, params,
+                                              functools.partial(func, *args, **kwargs),
+                                              timeout=self._timeout,
+                                              encode=encode_response,
+                                              decode=decode_response)
@@ -0,0 +1,289 @@
+import configparser
+import logging
+import random
+import time
+from typing import Any, AsyncIterator, Callable, List, Optional
+
+from iaas import exceptions as iaas_ex
+from iaas.deadline import deadline, expired, sleep
+from iaas.enums import Providers
+from iaas.tracing import span, traced
+from iaas.transport import DEFAULT_TRANSPORT, Transport
+from iaas.vm import VirtualMachine, VmFilter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30.0
+
+
+def set_config_path(path: Optional[str]) -> str:
+    """
+    Returns the path to the config file. If no path is specified it will use the default path.
+
+    :param path: (Optional) The full path to a config file
+    :return: path: The evaluated path to the config file
+    """
+    if path:
+        return path
+    else:
+        return "./config/simulated.ini"
+
+
+class _SimulatedVm:
+    """ A VM in the simulated fleet. Transitions complete when transition_at has passed """
+
+    __slots__ = ("vm_id", "display_name", "public_ip", "_state", "_target", "_transition_at")
+
+    def __init__(self, vm_id: str, display_name: str, public_ip: str, state: str):
+        self.vm_id = vm_id
+        self.display_name = display_name
+        self.public_ip = public_ip
+        self._state = state
+        self._target: Optional[str] = None
+        self._transition_at = 0.0
+
+    @property
+    def state(self) -> str:
+        self._settle()
+        return self._state
+
+    @property
+    def transitioning(self) -> bool:
+        self._settle()
+        return self._target is not None
+
+    def transition(self, target: str, delay: float, current: Optional[str] = None) -> None:
+        if current is not None:
+            self._state = current
+        self._target = target
+        self._transition_at = time.monotonic() + delay
+
+    def _settle(self) -> None:
+        if self._target is not None and time.monotonic() >= self._transition_at:
+            self._state, self._target = self._target, None
+
+
+class SimulatedClient:
+    """
+    In process simulated provider for load testing without a real account.
+
+    The fleet size, call latency, failure rate and the time VMs take to start and stop are set in the config file.
+    VMs keep reporting their previous state until a start or stop has completed.
+
+    Every simulated call goes through the transport like a real provider request, so it can be scheduled,
+    recorded and replayed, and is bounded by the per call timeout set in the config file.
+    """
+
+    def __init__(self, path: Optional[str] = None, transport: Optional[Transport] = None):
+        self._config_path = set_config_path(path)
+        self._transport = transport if transport else DEFAULT_TRANSPORT
+        self._config = configparser.ConfigParser()
+        with span("simulated.config", path=self._config_path):
+            self._config.read(self._config_path)
+
+        self._fleet_size = self._config.getint(section="DEFAULT", option="fleetSize", fallback=100)
+        self._page_size = self._config.getint(section="DEFAULT", option="pageSize", fallback=100)
+        self._latency = self._config.getfloat(section="DEFAULT", option="latency", fallback=0.05)
+        self._latency_jitter = self._config.getfloat(section="DEFAULT", option="latencyJitter", fallback=0.0)
+        self._latency_distribution = self._config.get(section="DEFAULT", option="latencyDistribution",
+                                                      fallback="fixed")
+        self._failure_rate = self._config.getfloat(section="DEFAULT", option="failureRate", fallback=0.0)
+        self._start_delay = self._config.getfloat(section="DEFAULT", option="startDelay", fallback=30.0)
+        self._stop_delay = self._config.getfloat(section="DEFAULT", option="stopDelay", fallback=10.0)
+        self._stopped_ratio = self._config.getfloat(section="DEFAULT", option="stoppedRatio", fallback=0.0)
+        self._random = random.Random(self._config.get(section="DEFAULT", option="seed", fallback=None))
+        self._timeout = self._config.getfloat(section="DEFAULT", option="timeout", fallback=DEFAULT_TIMEOUT)
+
+        if self._latency_distribution not in ("fixed", "uniform", "normal", "exponential"):
+            raise iaas_ex.ClientException(
+                f"Unknown latencyDistribution {self._latency_distribution} in {self._config_path}")
+
+        self._fleet = {}
+        for index in range(self._fleet_size):
+            vm_id = f"sim-{index:06d}"
+            state = "STOPPED" if self._random.random() < self._stopped_ratio else "RUNNING"
+            self._fleet[vm_id] = _SimulatedVm(vm_id=vm_id,
+                                              display_name=f"simulated-{index}",
+                                              public_ip=f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}",
+                                              state=state)
+
+    @traced("simulated.get_all_vms")
+    async def get_all_vms(self, vm_filter: Optional[VmFilter] = None, timeout: Optional[float] = None,
+                          partial: bool = True) -> list[VirtualMachine]:
+        """
+        Returns a list of VirtualMachine class instances.
+
+        If the timeout or an outer iaas.deadline is reached the VMs fetched so far are returned,
+        unless partial is False in which case iaas.exceptions.DeadlineExceeded is raised.
+        If a page reaches the per call timeout before then DeadlineExceeded is raised.
+
+        :param vm_filter: (Optional) Only return VMs matching the filter.
+        :param timeout: (Optional) Seconds allowed for the whole listing.
+        :param partial: (Optional) Return the VMs fetched so far if the deadline is reached.
+        :return: A list of iaas.vm.VirtualMachine
+        """
+        vm_list = []
+        with deadline(timeout):
+            try:
+                async for vm in self.iter_vms(vm_filter):
+                    vm_list.append(vm)
+            except iaas_ex.DeadlineExceeded as de:
+                # a per call timeout is not the end of the operation, only return part of the list at the deadline
+                if not partial or not expired():
+                    raise
+                logger.warning(f"Returning {len(vm_list)} simulated VMs, listing did not complete - {de.message}")
+
+        return vm_list
+
+    async def iter_vms(self, vm_filter: Optional[VmFilter] = None) -> AsyncIterator[VirtualMachine]:
+        """
+        Yields VirtualMachine class instances a page at a time, each page costs one simulated call.
+
+        :param vm_filter: (Optional) Only yield VMs matching the filter.
+        :return: An async iterator of iaas.vm.VirtualMachine
+        """
+        vm_filter = vm_filter if vm_filter else VmFilter()
+        vm_ids = sorted(vm_filter.vm_ids) if vm_filter.vm_ids is not None else None
+        vm_count = len(vm_ids) if vm_ids is not None else self._fleet_size
+
+        for offset in range(0, vm_count, self._page_size):
+            params = {"offset": offset, "limit": self._page_size}
+            if vm_ids is not None:
+                params["vm_ids"] = vm_ids
+            page = await self._call("list_vms", params, lambda o=offset: self._list_page(vm_ids, o))
+
+            with span("vm.create"):
+                vm_list = [self._to_vm(record) for record in page
+                           if vm_filter.match_id(record["vm_id"])
+                           and vm_filter.match_state(record["state"])
+                           and vm_filter.match_name(record["display_name"])]
+            for vm in vm_list:
+                yield vm
+
+    @traced("simulated.stop_vm")
+    async def stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        """
+        Stops the supplied VM after the configured stopDelay.
+
+        :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
+        :return: The vm state.
+        """
+        return await self._transition(vm, "stop", "RUNNING", "STOPPED", self._stop_delay, "STOPPING", timeout)
+
+    @traced("simulated.force_stop_vm")
+    async def force_stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        """
+        Power off the supplied VM immediately.
+
+        :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
+        :return: The vm state.
+        """
+        return await self._transition(vm, "force_stop", "RUNNING", "STOPPED", 0.0, "STOPPED", timeout)
+
+    @traced("simulated.start_vm")
+    async def start_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        """
+        Starts the supplied VM, it reaches RUNNING after the configured startDelay.
+
+        :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
+        :return: The vm state.
+        """
+        return await self._transition(vm, "start", "STOPPED", "RUNNING", self._start_delay, "STARTING", timeout)
+
+    @traced("simulated.restart_vm")
+    async def restart_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        """
+        Restarts the supplied VM. It reports STOPPED until it is RUNNING again after stopDelay and startDelay.
+
+        :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
+        :return: The vm state.
+        """
+        def restart() -> str:
+            self._action_target(vm, "RUNNING").transition("RUNNING", self._stop_delay + self._start_delay,
+                                                          current="STOPPED")
+            return "STOPPING"
+
+        with deadline(timeout):
+            return await self._call("instance_action", {"vm_id": vm.vm_id, "action": "restart"}, restart)
+
+    @traced("simulated.get_public_ips")
+    async def get_public_ips(self, vm: VirtualMachine, timeout: Optional[float] = None) -> List[str]:
+        """
+        Returns a list of IPs for the supplied VM.
+
+        :param vm: A virtual machine.
+        :param timeout: (Optional) Seconds allowed for the call.
+        :return: A list of IPs.
+        """
+        with deadline(timeout):
+            return await self._call("get_public_ips", {"vm_id": vm.vm_id}, lambda: [self._get(vm).public_ip])
+
+    async def _transition(self, vm: VirtualMachine, action: str, required: str, target: str, delay: float,
+                          result: str, timeout: Optional[float]) -> str:
+        def transition() -> str:
+            self._action_target(vm, required).transition(target, delay)
+            return result
+
+        with deadline(timeout):
+            return await self._call("instance_action", {"vm_id": vm.vm_id, "action": action}, transition)
+
+    def _action_target(self, vm: VirtualMachine, required: str) -> _SimulatedVm:
+        sim_vm = self._get(vm)
+        if sim_vm.transitioning or sim_vm.state != required:
+            raise iaas_ex.ProviderError(
+                f"Simulated API error, action not allowed for {vm.vm_id} in state {sim_vm.state}")
+        return sim_vm
+
+    def _get(self, vm: VirtualMachine) -> _SimulatedVm:
+        sim_vm = self._fleet.get(vm.vm_id)
+        if sim_vm is None:
+            raise iaas_ex.ProviderError(f"Simulated API error, VM {vm.vm_id} not found")
+        return sim_vm
+
+    def _list_page(self, vm_ids: Optional[List[str]], offset: int) -> List[dict[str, Any]]:
+        if vm_ids is not None:
+            sim_vms = [self._fleet[vm_id] for vm_id in vm_ids[offset:offset + self._page_size] if vm_id in self._fleet]
+        else:
+            sim_vms = [self._fleet[f"sim-{index:06d}"]
+                       for index in range(offset, min(offset + self._page_size, self._fleet_size))]
+
+        return [{"vm_id": sim_vm.vm_id, "display_name": sim_vm.display_name, "state": sim_vm.state,
+                 "public_ip": sim_vm.public_ip} for sim_vm in sim_vms]
+
+    def _to_vm(self, record: dict[str, Any]) -> VirtualMachine:
+        return VirtualMachine(vm_id=record["vm_id"], display_name=record["display_name"], state=record["state"],
+                              provider=Providers.SIMULATED, public_ips=[record["public_ip"]])
+
+    async def _call(self, operation: str, params: dict[str, Any], func: Callable[[], Any]) -> Any:
+        """
+        Sends a simulated call through the transport. The call waits for a latency drawn from the configured
+        distribution, fails at the configured rate, then returns the response of func.
+
+        :param operation: The name of the simulated API operation.
+        :param params: The parameters identifying the request.
+        :param func: Returns the response from the simulated fleet.
+        :return: The response.
+        """
+        async def simulate() -> Any:
+            await sleep(self._draw_latency())
+            if self._failure_rate and self._random.random() < self._failure_rate:
+                raise iaas_ex.ProviderError(f"Simulated API error returned from {operation}")
+            return func()
+
+        with span(f"simulated.{operation}"):
+            return await self._transport.call("simulated", operation, params, simulate, self._timeout)
+
+    def _draw_latency(self) -> float:
+        if self._latency_distribution == "uniform":
+            latency = self._random.uniform(self._latency - self._latency_jitter, self._latency + self._latency_jitter)
+        elif self._latency_distribution == "normal":
+            latency = self._random.gauss(self._latency, self._latency_jitter)
+        elif self._latency_distribution == "exponential":
+            latency = self._random.expovariate(1 / self._latency) if self._latency > 0 else 0.0
+        else:
+            latency = self._latency
+        return max(latency, 0.0)
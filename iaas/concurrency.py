@@ -0,0 +1,47 @@
+import asyncio
+import itertools
+from typing import Any, AsyncIterator, Coroutine, Iterable, TypeVar
+
+"""
+Helpers for running many provider lookups at once without holding the whole fleet in memory.
+"""
+T = TypeVar("T")
+
+DEFAULT_MAX_IN_FLIGHT = 20
+
+
+async def bounded_as_completed(coroutines: Iterable[Coroutine[Any, Any, T]],
+                               max_in_flight: int = DEFAULT_MAX_IN_FLIGHT) -> AsyncIterator[T]:
+    """
+    Runs the coroutines with at most max_in_flight running at once and yields each result as it completes.
+
+    A coroutine is only started once the caller has taken the results of those before it, so a slow caller
+    holds back the lookups rather than letting finished results pile up. If a coroutine raises, the others
+    are cancelled and the exception is raised to the caller.
+
+    :param coroutines: The coroutines to run, a generator creates them only as they are started.
+    :param max_in_flight: (Optional) The maximum number of coroutines running at once.
+    :return: An async iterator of the results in the order they complete.
+    """
+    pending = iter(coroutines)
+    running, done = set(), set()
+    try:
+        while True:
+            for coroutine in itertools.islice(pending, max(max_in_flight, 1) - len(running)):
+                running.add(asyncio.create_task(coroutine))
+            if not running:
+                return
+
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            while done:
+                yield done.pop().result()
+    finally:
+        # the caller may stop iterating early, don't leave lookups running in the background
+        for task in running:
+            task.cancel()
+        for coroutine in pending:
+            coroutine.close()
+        # lookups that finished alongside an error are dropped, retrieve their exceptions so they are not logged
+        for task in done | running:
+            if task.done() and not task.cancelled():
+                task.exception()
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+from iaas import exceptions as iaas_ex
+
+"""
+Deadlines are carried in a context variable so a timeout set on a high level client method
+flows down to every HTTP request made on its behalf, including requests made from child tasks.
+
+The stored value is an absolute time.monotonic() value and not a duration.
+"""
+_deadline: ContextVar[Optional[float]] = ContextVar("iaas_deadline", default=None)
+
+# event loop timers may fire up to the clock resolution early, a deadline that close is treated as passed
+_RESOLUTION = time.get_clock_info("monotonic").resolution
+
+
+@contextmanager
+def deadline(timeout: Optional[float]) -> Iterator[None]:
+    """
+    Sets a deadline for all provider calls made within the context.
+    Nested deadlines can only shorten an outer deadline, never extend it.
+
+    :param timeout: (Optional) Seconds until the deadline. None keeps the current deadline.
+    :return: None
+    """
+    if timeout is None:
+        yield
+        return
+
+    expires = time.monotonic() + timeout
+    current = _deadline.get()
+    if current is not None:
+        expires = min(current, expires)
+
+    token = _deadline.set(expires)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """
+    Returns the number of seconds left before the current deadline, capped at the default.
+
+    :param default: (Optional) The value to use if no deadline is set or the deadline is further away.
+    :return: Seconds remaining. None if there is no deadline and no default.
+    """
+    expires = _deadline.get()
+    if expires is None:
+        return default
+
+    left = expires - time.monotonic()
+    if default is not None:
+        left = min(left, default)
+    return left
+
+
+def expired() -> bool:
+    """
+    Checks whether the current deadline has passed.
+    Used to tell the operation deadline being reached apart from the per call timeout of a single request.
+
+    :return: True if a deadline is set and has passed.
+    """
+    left = remaining()
+    return left is not None and left <= _RESOLUTION
+
+
+async def sleep(delay: float, timeout: Optional[float] = None) -> None:
+    """
+    Sleeps for the delay, or raises DeadlineExceeded once the timeout or current deadline is reached if sooner.
+
+    :param delay: Seconds to sleep.
+    :param timeout: (Optional) The maximum number of seconds to wait.
+    :return: None
+    """
+    wait = remaining(timeout)
+    if wait is not None and delay > wait:
+        await asyncio.sleep(max(wait, 0))
+        raise iaas_ex.DeadlineExceeded("Deadline exceeded")
+
+    await asyncio.sleep(delay)
+
+
+async def run_blocking(func: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """
+    Runs a blocking call in a worker thread so it does not hold the event loop.
+
+    The wait is bounded by the smaller of timeout and the current deadline. If the calling task is cancelled
+    the wait is abandoned straight away, the worker thread finishes in the background once the call returns
+    or its own transport timeout fires.
+
+    :param func: The blocking function to call.
+    :param timeout: (Optional) The maximum number of seconds to wait for this call.
+    :return: The result of the function.
+    """
+    wait = remaining(timeout)
+    if wait is not None and wait <= 0:
+        raise iaas_ex.DeadlineExceeded(f"Deadline exceeded before calling {_name(func)}")
+
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(func, *args, **kwargs), timeout=wait)
+    except asyncio.TimeoutError:
+        raise iaas_ex.DeadlineExceeded(f"Deadline exceeded waiting for {_name(func)}") from None
+
+
+async def run_async(func: Callable[..., Awaitable[Any]], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """
+    Awaits an asynchronous call bounded by the smaller of timeout and the current deadline.
+
+    :param func: The coroutine function to call.
+    :param timeout: (Optional) The maximum number of seconds to wait for this call.
+    :return: The result of the function.
+    """
+    wait = remaining(timeout)
+    if wait is not None and wait <= 0:
+        raise iaas_ex.DeadlineExceeded(f"Deadline exceeded before calling {_name(func)}")
+
+    try:
+        return await asyncio.wait_for(func(*args, **kwargs), timeout=wait)
+    except asyncio.TimeoutError:
+        raise iaas_ex.DeadlineExceeded(f"Deadline exceeded waiting for {_name(func)}") from None
+
+
+def _name(func: Callable[..., Any]) -> str:
+    """ Returns a readable name for a function or functools.partial """
+    return getattr(func, "__name__", None) or getattr(getattr(func, "func", None), "__name__", repr(func))
@@ -0,0 +1,263 @@
+import asyncio
+import functools
+import inspect
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, List, Optional
+
+"""
+Diagnostics for finding blocking work hidden inside client coroutines.
+
+Every step of an instrumented coroutine, the code run between two awaits, is timed on the event loop thread.
+While the detector is running every task created on the loop is instrumented too, so blocking in tasks a client
+creates internally, eg the per VM lookups of iter_vms, is reported against the coroutine the task runs.
+A step of a nested instrumented coroutine is only counted once, against the innermost coroutine.
+
+A watchdog thread samples the stack of the event loop thread when a step holds the loop for longer than
+the threshold, so the report shows the call that was blocking and not just the coroutine that made it.
+"""
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BlockingReport:
+    """ A client coroutine that held the event loop for longer than the threshold """
+
+    function: str
+    duration: float
+    stack: List[str] = field(default_factory=list)
+    timestamp: float = field(default_factory=time.time)
+
+
+@dataclass
+class LoopLag:
+    """ How late the event loop ran a callback scheduled by the lag monitor """
+
+    samples: int = 0
+    last: float = 0.0
+    max: float = 0.0
+    total: float = 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.samples if self.samples else 0.0
+
+
+class _Step:
+    """ The coroutine step currently running on the event loop thread """
+
+    def __init__(self, function: str):
+        self.function = function
+        self.started_at = time.monotonic()
+        # time spent in the steps of nested instrumented coroutines, which are reported against those instead
+        self.nested = 0.0
+        self.report: Optional[BlockingReport] = None
+
+    def duration(self) -> float:
+        return time.monotonic() - self.started_at - self.nested
+
+
+class BlockingDetector:
+    """
+    Measures event loop lag and reports instrumented coroutines that hold the loop longer than the threshold.
+
+    Usage:
+        detector = BlockingDetector(threshold=0.05)
+        detector.start()
+        client = detector.instrument(client_factory(Providers.NETCUP))
+        ...
+        detector.stop()
+        print(detector.reports)
+    """
+
+    def __init__(self, threshold: float = 0.1, lag_interval: float = 0.25, max_reports: int = 1000,
+                 on_report: Optional[Callable[[BlockingReport], None]] = None):
+        self.threshold = threshold
+        self.lag = LoopLag()
+        self.reports = deque(maxlen=max_reports)
+        self._lag_interval = lag_interval
+        self._on_report = on_report
+        self._steps: List[_Step] = []
+        self._loop_thread_id: Optional[int] = None
+        self._stopped = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+        self._lag_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._previous_task_factory = None
+
+    def start(self) -> None:
+        """
+        Starts the watchdog thread, the loop lag monitor and instruments every task created from now on.
+        Must be called from the event loop thread.
+
+        :return: None
+        """
+        self._loop_thread_id = threading.get_ident()
+        self._loop = asyncio.get_running_loop()
+        self._stopped.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="iaas-blocking-detector", daemon=True)
+        self._watchdog.start()
+        self._lag_task = self._loop.create_task(self._monitor_lag())
+        self._previous_task_factory = self._loop.get_task_factory()
+        self._loop.set_task_factory(self._task_factory)
+
+    def stop(self) -> None:
+        """
+        Stops the watchdog thread and the loop lag monitor.
+
+        :return: None
+        """
+        self._stopped.set()
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._loop is not None:
+            self._loop.set_task_factory(self._previous_task_factory)
+            self._loop, self._previous_task_factory = None, None
+
+    def instrument(self, client: Any) -> "InstrumentedClient":
+        """
+        Wraps a client so each of its coroutine methods is timed.
+
+        :param client: An instance of iaas.client.Client
+        :return: The instrumented client.
+        """
+        return InstrumentedClient(client, self)
+
+    def watch(self, awaitable: Awaitable, function: str) -> "_InstrumentedAwaitable":
+        """
+        Times each step of an awaitable.
+
+        :param awaitable: A coroutine or other awaitable.
+        :param function: The name used in reports.
+        :return: An awaitable with the same result.
+        """
+        return _InstrumentedAwaitable(awaitable, function, self)
+
+    def _task_factory(self, loop: asyncio.AbstractEventLoop, coroutine: Any, **kwargs) -> asyncio.Future:
+        if asyncio.iscoroutine(coroutine):
+            coroutine = self._watch_task(coroutine)
+        if self._previous_task_factory is not None:
+            return self._previous_task_factory(loop, coroutine, **kwargs)
+        return asyncio.Task(coroutine, loop=loop, **kwargs)
+
+    async def _watch_task(self, coroutine: Any) -> Any:
+        return await self.watch(coroutine, getattr(coroutine, "__qualname__", repr(coroutine)))
+
+    def _enter(self, function: str) -> None:
+        self._steps.append(_Step(function))
+
+    def _exit(self) -> None:
+        step = self._steps.pop()
+        elapsed = time.monotonic() - step.started_at
+        if self._steps:
+            self._steps[-1].nested += elapsed
+        duration = elapsed - step.nested
+        if duration < self.threshold:
+            return
+
+        if step.report is None:
+            step.report = self._report(step.function, duration, [])
+        else:
+            step.report.duration = duration
+
+        logger.warning(f"{step.function} held the event loop for {duration:.3f}s\n{''.join(step.report.stack)}")
+
+    def _report(self, function: str, duration: float, stack: List[str]) -> BlockingReport:
+        report = BlockingReport(function=function, duration=duration, stack=stack)
+        self.reports.append(report)
+        if self._on_report:
+            self._on_report(report)
+        return report
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.threshold / 2):
+            steps = list(self._steps)
+            if not steps:
+                continue
+
+            # the innermost step is the one actually running
+            step = steps[-1]
+            duration = step.duration()
+            if duration >= self.threshold and step.report is None:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = traceback.format_stack(frame) if frame else []
+                step.report = self._report(step.function, duration, stack)
+
+    async def _monitor_lag(self) -> None:
+        while True:
+            expected = time.monotonic() + self._lag_interval
+            await asyncio.sleep(self._lag_interval)
+            lag = max(time.monotonic() - expected, 0.0)
+            self.lag.samples += 1
+            self.lag.last = lag
+            self.lag.total += lag
+            self.lag.max = max(self.lag.max, lag)
+
+
+class _InstrumentedAwaitable:
+    """ Drives an awaitable, timing each step between awaits """
+
+    def __init__(self, awaitable: Awaitable, function: str, detector: BlockingDetector):
+        self._awaitable = awaitable
+        self._function = function
+        self._detector = detector
+
+    def __await__(self):
+        iterator = self._awaitable.__await__()
+        value, error = None, None
+        while True:
+            self._detector._enter(self._function)
+            try:
+                if error is not None:
+                    signal = iterator.throw(error)
+                else:
+                    signal = iterator.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self._detector._exit()
+
+            try:
+                value, error = (yield signal), None
+            except BaseException as e:
+                value, error = None, e
+
+
+class InstrumentedClient:
+    """ Proxies a client, timing each step of its coroutine methods and the iteration of iter_vms """
+
+    def __init__(self, client: Any, detector: BlockingDetector):
+        self._client = client
+        self._detector = detector
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._client, name)
+        function = f"{type(self._client).__name__}.{name}"
+
+        if inspect.iscoroutinefunction(attribute):
+            @functools.wraps(attribute)
+            def coroutine_wrapper(*args, **kwargs):
+                return self._detector.watch(attribute(*args, **kwargs), function)
+
+            return coroutine_wrapper
+
+        if inspect.isasyncgenfunction(attribute):
+            @functools.wraps(attribute)
+            async def async_generator_wrapper(*args, **kwargs):
+                iterator = attribute(*args, **kwargs)
+                while True:
+                    try:
+                        item = await self._detector.watch(iterator.__anext__(), function)
+                    except StopAsyncIteration:
+                        return
+                    yield item
+
+            return async_generator_wrapper
+
+        return attribute
@@ -1,4 +1,4 @@
-from enum import Enum, auto
+from enum import Enum, IntEnum, auto
 
 
 class Providers(Enum):
@@ -6,4 +6,12 @@ class Providers(Enum):
 
     ORACLE = auto()
     NETCUP = auto()
+    SIMULATED = auto()
 
+
+class Priority(IntEnum):
+    """ Scheduling priority of provider calls. Lower values are run first """
+
+    EMERGENCY = 0
+    USER = 1
+    BACKGROUND = 2
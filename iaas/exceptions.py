@@ -12,3 +12,10 @@ class ProviderError(Exception):
     def __init__(self, message):
         self.message = message
         super().__init__(self.message)
+
+
+class DeadlineExceeded(ProviderError):
+    """ Exception raised when a call to the IaaS API did not complete before its timeout or deadline """
+
+    def __init__(self, message):
+        super().__init__(message)
@@ -0,0 +1,263 @@
+import asyncio
+import csv
+import json
+import logging
+from typing import Any, AsyncIterable, List, Optional, Protocol, TextIO
+
+from iaas import exceptions as iaas_ex
+from iaas.client import Client
+from iaas.concurrency import DEFAULT_MAX_IN_FLIGHT
+from iaas.enums import Providers
+from iaas.vm import VirtualMachine
+
+"""
+Streams VM inventory to NDJSON, CSV, Parquet or Arrow.
+
+Writers take one VM at a time so a fleet can be exported straight from iter_vms or iter_all_vms
+without holding it in memory. The columnar writers buffer at most batch_size rows.
+
+Public IPs are only known when the provider returned them with the VM, currently the simulated provider and
+Netcup when getVServerInformation is available. Unknown IPs are written as null, an empty cell in CSV, and an
+empty list means the VM has no public IPs. export_vms can fetch the missing IPs, see ip_clients.
+"""
+logger = logging.getLogger(__name__)
+
+FIELDS = ("vm_id", "display_name", "state", "provider", "public_ips", "fetched_at")
+
+
+def vm_record(vm: VirtualMachine) -> dict[str, Any]:
+    """
+    Returns the exported fields of a VM.
+
+    :param vm: A virtual machine.
+    :return: A dictionary of the exported fields.
+    """
+    return {"vm_id": vm.vm_id,
+            "display_name": vm.display_name,
+            "state": vm.state,
+            "provider": vm.provider.name,
+            "public_ips": vm.public_ips,
+            "fetched_at": vm.fetched_at.isoformat() if vm.fetched_at else None}
+
+
+class InventoryWriter(Protocol):
+    """ Used as an interface for all inventory writers """
+
+    def write(self, vm: VirtualMachine) -> None:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class NdjsonWriter:
+    """ Writes one JSON object per VM per line """
+
+    def __init__(self, file: TextIO):
+        self._file = file
+
+    def write(self, vm: VirtualMachine) -> None:
+        self._file.write(json.dumps(vm_record(vm)) + "\n")
+
+    def close(self) -> None:
+        self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvWriter:
+    """
+    Writes a header followed by one row per VM. Multiple IPs are separated by a semicolon.
+    Unknown IPs and no IPs are both written as an empty cell, use another writer to tell them apart.
+    """
+
+    def __init__(self, file: TextIO):
+        self._file = file
+        self._writer = csv.writer(file)
+        self._writer.writerow(FIELDS)
+
+    def write(self, vm: VirtualMachine) -> None:
+        record = vm_record(vm)
+        record["public_ips"] = ";".join(record["public_ips"]) if record["public_ips"] else ""
+        self._writer.writerow([record[name] for name in FIELDS])
+
+    def close(self) -> None:
+        self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ParquetWriter:
+    """
+    Writes VMs to a Parquet file, one row group per batch.
+    Requires the pyarrow package.
+    """
+
+    def __init__(self, path: str, batch_size: int = 10000):
+        self._pa = import_pyarrow()
+        import pyarrow.parquet as pq
+
+        self._batch_size = batch_size
+        self._schema = inventory_schema(self._pa)
+        self._columns = {name: [] for name in FIELDS}
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, vm: VirtualMachine) -> None:
+        append_columns(self._columns, vm)
+        if len(self._columns["vm_id"]) >= self._batch_size:
+            self._flush()
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+    def _flush(self) -> None:
+        if self._columns["vm_id"]:
+            self._writer.write_table(self._pa.table(self._columns, schema=self._schema))
+            self._columns = {name: [] for name in FIELDS}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ArrowWriter:
+    """
+    Writes VMs to an Arrow IPC stream file, one record batch per batch.
+    Requires the pyarrow package.
+    """
+
+    def __init__(self, path: str, batch_size: int = 10000):
+        self._pa = import_pyarrow()
+
+        self._batch_size = batch_size
+        self._schema = inventory_schema(self._pa)
+        self._columns = {name: [] for name in FIELDS}
+        self._sink = self._pa.OSFile(path, "wb")
+        self._writer = self._pa.ipc.new_stream(self._sink, self._schema)
+
+    def write(self, vm: VirtualMachine) -> None:
+        append_columns(self._columns, vm)
+        if len(self._columns["vm_id"]) >= self._batch_size:
+            self._flush()
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+        self._sink.close()
+
+    def _flush(self) -> None:
+        if self._columns["vm_id"]:
+            self._writer.write_batch(self._pa.record_batch(self._columns, schema=self._schema))
+            self._columns = {name: [] for name in FIELDS}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def import_pyarrow() -> Any:
+    """
+    Imports pyarrow which is only required for the columnar writers.
+
+    :return: The pyarrow module.
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        return pyarrow
+    except ImportError:
+        raise iaas_ex.ClientException("Columnar export requires the pyarrow package to be installed") from None
+
+
+def inventory_schema(pa: Any) -> Any:
+    """
+    Returns the Arrow schema used by the columnar writers.
+
+    :param pa: The pyarrow module.
+    :return: pyarrow.Schema
+    """
+    return pa.schema([("vm_id", pa.string()),
+                      ("display_name", pa.string()),
+                      ("state", pa.string()),
+                      ("provider", pa.string()),
+                      ("public_ips", pa.list_(pa.string())),
+                      ("fetched_at", pa.timestamp("us", tz="UTC"))])
+
+
+def append_columns(columns: dict[str, list], vm: VirtualMachine) -> None:
+    """
+    Appends a VM to the column buffers of a columnar writer.
+
+    :param columns: The column buffers keyed by field name.
+    :param vm: A virtual machine.
+    :return: None
+    """
+    columns["vm_id"].append(vm.vm_id)
+    columns["display_name"].append(vm.display_name)
+    columns["state"].append(vm.state)
+    columns["provider"].append(vm.provider.name)
+    columns["public_ips"].append(vm.public_ips)
+    columns["fetched_at"].append(vm.fetched_at)
+
+
+async def export_vms(vms: AsyncIterable[VirtualMachine], writer: InventoryWriter, close: bool = True,
+                     ip_clients: Optional[dict[Providers, Client]] = None,
+                     max_in_flight: int = DEFAULT_MAX_IN_FLIGHT) -> int:
+    """
+    Writes each VM to the writer as it is yielded.
+
+    VMs returned without their IPs, eg all Oracle VMs, are written with unknown IPs unless a client for their
+    provider is in ip_clients. Their IPs are then fetched with get_public_ips, max_in_flight at a time, before
+    they are written. A VM whose IPs cannot be fetched is logged and written with unknown IPs.
+
+    :param vms: An async iterable of VMs, eg client.iter_vms() or iter_all_vms(clients).
+    :param writer: The inventory writer.
+    :param close: (Optional) Close the writer once all VMs have been written.
+    :param ip_clients: (Optional) The clients used to fetch missing IPs, keyed by provider.
+    :param max_in_flight: (Optional) The maximum number of IP lookups running at once.
+    :return: The number of VMs written.
+    """
+    ip_clients = ip_clients if ip_clients else {}
+    count = 0
+    batch: List[VirtualMachine] = []
+    try:
+        async for vm in vms:
+            if vm.public_ips is None and vm.provider in ip_clients:
+                batch.append(vm)
+                if len(batch) >= max_in_flight:
+                    count += await _write_with_ips(batch, writer, ip_clients)
+                    batch = []
+            else:
+                writer.write(vm)
+                count += 1
+        count += await _write_with_ips(batch, writer, ip_clients)
+    finally:
+        if close:
+            writer.close()
+    return count
+
+
+async def _write_with_ips(batch: List[VirtualMachine], writer: InventoryWriter,
+                          ip_clients: dict[Providers, Client]) -> int:
+    results = await asyncio.gather(*[ip_clients[vm.provider].get_public_ips(vm) for vm in batch],
+                                   return_exceptions=True)
+    for vm, result in zip(batch, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Exporting {vm.provider.name} VM {vm.vm_id} without IPs, the lookup failed - {result}")
+        else:
+            vm.public_ips = result
+        writer.write(vm)
+    return len(batch)
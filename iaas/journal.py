@@ -0,0 +1,285 @@
+import asyncio
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, List, Optional
+
+from iaas import exceptions as iaas_ex
+from iaas.deadline import deadline, remaining, sleep
+from iaas.vm import VirtualMachine, VmFilter
+
+"""
+Journals VM lifecycle actions keyed by (provider, vm_id, action) so duplicate actions are not sent to the provider.
+
+A duplicate of a pending action waits for and returns the result of the original, for no longer than the current
+deadline. A duplicate of an action that completed within the ttl returns the recorded result without calling the provider, unless another action has run
+for the VM since, eg a start after a stop is always sent.
+
+Each action runs with a retry token in a context variable. Providers that support idempotent requests,
+such as OCI with opc_retry_token, pass it on so a retried action is not applied twice.
+"""
+_retry_token: ContextVar[Optional[str]] = ContextVar("iaas_retry_token", default=None)
+
+
+@contextmanager
+def retry_token(token: str) -> Iterator[None]:
+    """
+    Sets the retry token for provider calls made within the context.
+
+    :param token: The retry token.
+    :return: None
+    """
+    reset_token = _retry_token.set(token)
+    try:
+        yield
+    finally:
+        _retry_token.reset(reset_token)
+
+
+def current_retry_token() -> Optional[str]:
+    """
+    Returns the retry token of the action currently being run.
+
+    :return: The retry token. None if no action is being run through a journal.
+    """
+    return _retry_token.get()
+
+
+class _ActionAbandoned(Exception):
+    """ The caller running an action was cancelled, a waiting duplicate runs it with the same retry token """
+
+    def __init__(self, token: str):
+        self.token = token
+        super().__init__(token)
+
+
+class ActionJournal:
+    """
+    In process action journal. Duplicate actions from any task in this process are collapsed.
+    If the caller running an action is cancelled, a duplicate waiting for it runs the action instead.
+    """
+
+    def __init__(self, ttl: float = 10.0):
+        self._ttl = ttl
+        self._pending = {}
+        self._completed = {}
+
+    async def run(self, vm: VirtualMachine, action: str, func: Callable[[], Awaitable[str]]) -> str:
+        """
+        Runs the action unless the same action is pending or completed within the ttl for the VM.
+
+        :param vm: The VM the action is for.
+        :param action: The name of the action, eg start.
+        :param func: A function returning the awaitable that performs the action.
+        :return: The result of the action.
+        """
+        key = (vm.provider.name, vm.vm_id, action)
+        token = None
+
+        while True:
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            try:
+                # the original keeps running if this caller gives up waiting for it
+                return await asyncio.wait_for(asyncio.shield(pending), remaining())
+            except asyncio.TimeoutError:
+                raise iaas_ex.DeadlineExceeded(f"Deadline exceeded waiting for pending {action} of {vm.vm_id}") \
+                    from None
+            except _ActionAbandoned as abandoned:
+                # the request may already have been sent, so the same token is used when taking over
+                token = abandoned.token
+
+        vm_key = key[:2]
+        completed = self._completed.get(vm_key)
+        if completed is not None and completed[0] == action and time.monotonic() - completed[2] < self._ttl:
+            return completed[1]
+
+        # only the last action of a VM is kept, so a start after a stop is not answered from the earlier start
+        self._completed.pop(vm_key, None)
+        token = token if token else uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            result = await self._execute(key, func, token)
+        except asyncio.CancelledError:
+            # the cancellation belongs to this caller, duplicates waiting for the action take it over
+            future.set_exception(_ActionAbandoned(token))
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark the exception as retrieved in case there were no duplicates waiting for it
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+        future.set_result(result)
+        self._completed[vm_key] = (action, result, time.monotonic())
+        self._prune()
+        return result
+
+    async def _execute(self, key: tuple[str, str, str], func: Callable[[], Awaitable[str]], token: str) -> str:
+        with retry_token(token):
+            return await func()
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for vm_key in [vm_key for vm_key, (_, _, finished_at) in self._completed.items()
+                       if now - finished_at >= self._ttl]:
+            del self._completed[vm_key]
+
+
+@dataclass
+class _Claim:
+    """ The outcome of claiming an action in the SQLite journal """
+
+    token: Optional[str] = None
+    result: Optional[str] = None
+    wait: bool = False
+
+
+class SqliteActionJournal(ActionJournal):
+    """
+    Action journal shared by every process using the same SQLite file.
+
+    A pending action older than stale_after is assumed to belong to a process that died and is run again.
+    Failed and abandoned actions are retried with their original retry token.
+    Starting or completing an action removes the completed record of any other action for the same VM.
+    """
+
+    def __init__(self, path: str, ttl: float = 10.0, stale_after: float = 300.0, poll_interval: float = 0.5):
+        super().__init__(ttl)
+        self._path = path
+        self._stale_after = stale_after
+        self._poll_interval = poll_interval
+
+        connection = self._connect()
+        try:
+            connection.execute("CREATE TABLE IF NOT EXISTS actions ("
+                               "key TEXT PRIMARY KEY, "
+                               "token TEXT NOT NULL, "
+                               "status TEXT NOT NULL, "
+                               "result TEXT, "
+                               "updated_at REAL NOT NULL, "
+                               "pid INTEGER NOT NULL)")
+        finally:
+            connection.close()
+
+    async def _execute(self, key: tuple[str, str, str], func: Callable[[], Awaitable[str]], token: str) -> str:
+        # the token is taken from the journal, an abandoned action keeps its token in its failed row
+        journal_key = "/".join(key)
+        while True:
+            claim = await asyncio.to_thread(self._claim, journal_key)
+            if claim.result is not None:
+                return claim.result
+            if not claim.wait:
+                break
+            # another process is running the same action, raises DeadlineExceeded once the deadline is reached
+            await sleep(self._poll_interval)
+
+        with retry_token(claim.token):
+            try:
+                result = await func()
+            except BaseException:
+                await asyncio.shield(asyncio.to_thread(self._finish, journal_key, "failed", None))
+                raise
+
+        await asyncio.to_thread(self._finish, journal_key, "done", result)
+        return result
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30, isolation_level=None)
+
+    def _claim(self, journal_key: str) -> _Claim:
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT token, status, result, updated_at FROM actions WHERE key = ?",
+                                     (journal_key,)).fetchone()
+            now = time.time()
+            token = uuid.uuid4().hex
+            if row is not None:
+                row_token, status, result, updated_at = row
+                age = now - updated_at
+                if status == "pending" and age < self._stale_after:
+                    connection.execute("COMMIT")
+                    return _Claim(wait=True)
+                if status == "done" and age < self._ttl:
+                    connection.execute("COMMIT")
+                    return _Claim(result=result)
+                if status == "pending" or (status == "failed" and age < self._stale_after):
+                    token = row_token
+
+            connection.execute("INSERT OR REPLACE INTO actions (key, token, status, result, updated_at, pid) "
+                               "VALUES (?, ?, 'pending', NULL, ?, ?)", (journal_key, token, now, os.getpid()))
+            self._forget_other_actions(connection, journal_key)
+            connection.execute("COMMIT")
+            return _Claim(token=token)
+        except sqlite3.Error as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise iaas_ex.ClientException(f"Unable to update action journal {self._path} - {e}") from None
+        finally:
+            connection.close()
+
+    def _finish(self, journal_key: str, status: str, result: Optional[str]) -> None:
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("UPDATE actions SET status = ?, result = ?, updated_at = ? WHERE key = ?",
+                               (status, result, time.time(), journal_key))
+            if status == "done":
+                self._forget_other_actions(connection, journal_key)
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _forget_other_actions(connection: sqlite3.Connection, journal_key: str) -> None:
+        """ Removes the completed records of the other actions for the VM of the journal key """
+        vm_prefix = journal_key.rsplit("/", 1)[0] + "/"
+        connection.execute("DELETE FROM actions WHERE substr(key, 1, ?) = ? AND key != ? AND status = 'done'",
+                           (len(vm_prefix), vm_prefix, journal_key))
+
+
+class JournaledClient:
+    """
+    Sends the lifecycle actions of a client through an action journal. Other methods are passed straight through.
+    The timeout of an action also bounds waiting for a duplicate of it, pending here or in another process.
+    """
+
+    def __init__(self, client: Any, journal: ActionJournal):
+        self._client = client
+        self._journal = journal
+
+    async def get_all_vms(self, vm_filter: Optional[VmFilter] = None, timeout: Optional[float] = None,
+                          partial: bool = True) -> list[VirtualMachine]:
+        return await self._client.get_all_vms(vm_filter, timeout, partial)
+
+    def iter_vms(self, vm_filter: Optional[VmFilter] = None) -> AsyncIterator[VirtualMachine]:
+        return self._client.iter_vms(vm_filter)
+
+    async def stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        with deadline(timeout):
+            return await self._journal.run(vm, "stop", lambda: self._client.stop_vm(vm, timeout))
+
+    async def force_stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        with deadline(timeout):
+            return await self._journal.run(vm, "force_stop", lambda: self._client.force_stop_vm(vm, timeout))
+
+    async def start_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        with deadline(timeout):
+            return await self._journal.run(vm, "start", lambda: self._client.start_vm(vm, timeout))
+
+    async def restart_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        with deadline(timeout):
+            return await self._journal.run(vm, "restart", lambda: self._client.restart_vm(vm, timeout))
+
+    async def get_public_ips(self, vm: VirtualMachine, timeout: Optional[float] = None) -> List[str]:
+        return await self._client.get_public_ips(vm, timeout)
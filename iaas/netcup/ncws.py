@@ -1,10 +1,16 @@
+import functools
+import threading
 import xml
 import xml.etree.ElementTree as et
-from typing import List
+from typing import Any, List, Optional
 from xml.etree.ElementTree import tostring
 
 import requests
 
+from iaas import exceptions as iaas_ex
+from iaas.deadline import remaining
+from iaas.tracing import span, traced
+from iaas.transport import DEFAULT_TRANSPORT, Transport
 from iaas.netcup.exceptions import ValidationException, ServiceException, NotAllowedException
 
 """
@@ -17,8 +23,10 @@ https://www.servercontrolpanel.de/WSEndUser?wsdl
 
 API_URL = "https://www.servercontrolpanel.de:443/SCP/WSEndUser"
 REQUEST_HEADERS = {'content-type': 'text/xml'}
+DEFAULT_TIMEOUT = 30.0
 ENVELOPE_ATTRIBUTES = {"xmlns:soapenv": "http://schemas.xmlsoap.org/soap/envelope/",
                        "xmlns:end": "http://enduser.service.web.vcp.netcup.de/"}
+_sessions = threading.local()
 
 
 def soap_message_factory(end_point: str, variables: dict[str, str]) -> xml.etree.ElementTree.Element:
@@ -47,45 +55,109 @@ def soap_message_factory(end_point: str, variables: dict[str, str]) -> xml.etree
     return envelope
 
 
-async def get_v_servers(login: str, password: str) -> List[str]:
+async def post_soap_message(end_point: str, variables: dict[str, str], timeout: Optional[float] = None,
+                            transport: Optional[Transport] = None) -> str:
+    """
+    Sends a SOAP request to the webservice through the transport without blocking the event loop.
+    The request is bounded by the smaller of the timeout and the current iaas.deadline.
+
+    :param end_point: The webservice endpoint.
+    :param variables: A dictionary of all the variables for the SOAP call.
+    :param timeout: (Optional) Seconds to wait for the webservice, defaults to DEFAULT_TIMEOUT.
+    :param transport: (Optional) The transport used to send the request, defaults to iaas.transport.DirectTransport.
+    :return: The response body.
+    """
+    with span("ncws.envelope", end_point=end_point):
+        soap_message = tostring(soap_message_factory(end_point=end_point, variables=variables))
+
+    request_timeout = remaining(timeout if timeout is not None else DEFAULT_TIMEOUT)
+    post = functools.partial(post_request, soap_message, request_timeout)
+
+    # the password is left out as the parameters are written to the cassette when recording
+    params = {field: data for field, data in variables.items() if field != "password"}
+
+    with span("ncws.http", end_point=end_point):
+        try:
+            return await (transport or DEFAULT_TRANSPORT).call("netcup", end_point, params, post, request_timeout)
+        except requests.exceptions.Timeout:
+            raise iaas_ex.DeadlineExceeded(f"Netcup API timed out calling {end_point}") from None
+
+
+def post_request(soap_message: bytes, timeout: Optional[float]) -> str:
+    """
+    Posts the SOAP message to the webservice. This is a blocking call.
+    Each worker thread keeps a session so connections to the webservice are reused between calls.
+
+    :param soap_message: The serialised SOAP envelope.
+    :param timeout: (Optional) Seconds to wait for the webservice.
+    :return: The response body.
+    """
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    response = session.post(API_URL, data=soap_message, headers=REQUEST_HEADERS, timeout=timeout)
+    return response.text
+
+
+def parse_response(soap_response: str) -> xml.etree.ElementTree.Element:
+    """
+    Checks the response for a webservice error and parses it.
+
+    :param soap_response: The response returned from the API call.
+    :return: xml.etree.ElementTree.Element
+    """
+    with span("ncws.parse"):
+        root = et.fromstring(soap_response)
+        fault_string = root.find(".//faultstring")
+        if fault_string is not None:
+            exception_factory(fault_string.text)
+        return root
+
+
+@traced("ncws.getVServers")
+async def get_v_servers(login: str, password: str, timeout: Optional[float] = None,
+                        transport: Optional[Transport] = None) -> List[str]:
     """
     Returns a list of virtual machine names.
 
     :param login: The account login name.
     :param password: The webservice password and not account password.
+    :param timeout: (Optional) Seconds to wait for the webservice, defaults to DEFAULT_TIMEOUT.
+    :param transport: (Optional) The transport used to send the request.
     :return: A list of server names.
     """
     var_dic = {"loginName": f"{login}",
                "password": f"{password}"}
 
-    soap_message = soap_message_factory(end_point="getVServers", variables=var_dic)
-    response = requests.post(API_URL, data=tostring(soap_message), headers=REQUEST_HEADERS)
-
-    check_for_error(response.text)
-    root = et.fromstring(response.text)
+    response_text = await post_soap_message(end_point="getVServers", variables=var_dic,
+                                            timeout=timeout, transport=transport)
+    root = parse_response(response_text)
     server_list = root.findall(".//return")
 
     return [element.text for element in server_list]
 
 
-async def get_v_server_nickname(login: str, password: str, vm_name: str) -> str:
+@traced("ncws.getVServerNickname")
+async def get_v_server_nickname(login: str, password: str, vm_name: str,
+                                timeout: Optional[float] = None,
+                                transport: Optional[Transport] = None) -> str:
     """
     Returns the nickname of the vm. So far has not worked during testing.
 
     :param login: The account login name.
     :param password: The webservice password and not account password.
     :param vm_name: The VM name and not the nickname.
+    :param timeout: (Optional) Seconds to wait for the webservice, defaults to DEFAULT_TIMEOUT.
+    :param transport: (Optional) The transport used to send the request.
     :return: VM nickname if available. An empty string if not available.
     """
     var_dic = {"loginName": f"{login}",
                "password": f"{password}",
                "vserverName": f"{vm_name}"}
 
-    soap_message = soap_message_factory(end_point="getVServerNickname", variables=var_dic)
-    response = requests.post(API_URL, data=tostring(soap_message), headers=REQUEST_HEADERS)
-
-    check_for_error(response.text)
-    root = et.fromstring(response.text)
+    response_text = await post_soap_message(end_point="getVServerNickname", variables=var_dic,
+                                            timeout=timeout, transport=transport)
+    root = parse_response(response_text)
     nickname = root.find(".//return")
     if nickname is not None:
         return nickname.text
@@ -93,24 +165,27 @@ async def get_v_server_nickname(login: str, password: str, vm_name: str) -> str:
         return ""
 
 
-async def get_v_server_state(login: str, password: str, vm_name: str) -> str:
+@traced("ncws.getVServerState")
+async def get_v_server_state(login: str, password: str, vm_name: str,
+                             timeout: Optional[float] = None,
+                             transport: Optional[Transport] = None) -> str:
     """
     Returns the VM state.
 
     :param login: The account login name.
     :param password: The webservice password and not account password.
     :param vm_name: The VM name and not the nickname.
+    :param timeout: (Optional) Seconds to wait for the webservice, defaults to DEFAULT_TIMEOUT.
+    :param transport: (Optional) The transport used to send the request.
     :return: The state of the VM (online/offline) if available. An empty string if not available.
     """
     var_dic = {"loginName": f"{login}",
                "password": f"{password}",
                "vserverName": f"{vm_name}"}
 
-    soap_message = soap_message_factory(end_point="getVServerState", variables=var_dic)
-    response = requests.post(API_URL, data=tostring(soap_message), headers=REQUEST_HEADERS)
-
-    check_for_error(response.text)
-    root = et.fromstring(response.text)
+    response_text = await post_soap_message(end_point="getVServerState", variables=var_dic,
+                                            timeout=timeout, transport=transport)
+    root = parse_response(response_text)
     state = root.find(".//return")
     if state is not None:
         return state.text
@@ -118,53 +193,62 @@ async def get_v_server_state(login: str, password: str, vm_name: str) -> str:
         return ""
 
 
-async def v_server_start(login: str, password: str, vm_name: str) -> str:
+@traced("ncws.vServerStart")
+async def v_server_start(login: str, password: str, vm_name: str,
+                         timeout: Optional[float] = None,
+                         transport: Optional[Transport] = None) -> str:
     """
     Starts the VM.
 
     :param login: The account login name.
     :param password: The webservice password and not account password.
     :param vm_name: The VM name and not the nickname.
+    :param timeout: (Optional) Seconds to wait for the webservice, defaults to DEFAULT_TIMEOUT.
+    :param transport: (Optional) The transport used to send the request.
     :return: Response from the webservice. True or false as a string not boolean.
     """
     var_dic = {"loginName": f"{login}",
                "password": f"{password}",
                "vserverName": f"{vm_name}"}
 
-    soap_message = soap_message_factory(end_point="vServerStart", variables=var_dic)
-    response = requests.post(API_URL, data=tostring(soap_message), headers=REQUEST_HEADERS)
-
-    check_for_error(response.text)
-    root = et.fromstring(response.text)
+    response_text = await post_soap_message(end_point="vServerStart", variables=var_dic,
+                                            timeout=timeout, transport=transport)
+    root = parse_response(response_text)
     api_response = root.find(".//return")
 
     return api_response.text
 
 
-async def v_server_power_off(login: str, password: str, vm_name: str) -> str:
+@traced("ncws.vServerPoweroff")
+async def v_server_power_off(login: str, password: str, vm_name: str,
+                             timeout: Optional[float] = None,
+                             transport: Optional[Transport] = None) -> str:
     """
     The Server will be shut down. Forced shutdown.
 
     :param login: The account login name.
     :param password: The webservice password and not account password.
     :param vm_name: The VM name and not the nickname.
+    :param timeout: (Optional) Seconds to wait for the webservice, defaults to DEFAULT_TIMEOUT.
+    :param transport: (Optional) The transport used to send the request.
     :return: Response from the webservice. True or false as a string not boolean.
     """
     var_dic = {"loginName": f"{login}",
                "password": f"{password}",
                "vserverName": f"{vm_name}"}
 
-    soap_message = soap_message_factory(end_point="vServerPoweroff", variables=var_dic)
-    response = requests.post(API_URL, data=tostring(soap_message), headers=REQUEST_HEADERS)
-
-    check_for_error(response.text)
-    root = et.fromstring(response.text)
+    response_text = await post_soap_message(end_point="vServerPoweroff", variables=var_dic,
+                                            timeout=timeout, transport=transport)
+    root = parse_response(response_text)
     api_response = root.find(".//return")
 
     return api_response.text
 
 
-async def v_server_acpi_shutdown(login: str, password: str, vm_name: str) -> str:
+@traced("ncws.vServerACPIShutdown")
+async def v_server_acpi_shutdown(login: str, password: str, vm_name: str,
+                                 timeout: Optional[float] = None,
+                                 transport: Optional[Transport] = None) -> str:
     """
     Sending an ACPI shutdown signal to operating system.
     If the signal will be accepted, the operating system will be shut down.
@@ -172,6 +256,8 @@ async def v_server_acpi_shutdown(login: str, password: str, vm_name: str) -> str
     :param login: The account login name.
     :param password: The webservice password and not account password.
     :param vm_name: The VM name and not the nickname.
+    :param timeout: (Optional) Seconds to wait for the webservice, defaults to DEFAULT_TIMEOUT.
+    :param transport: (Optional) The transport used to send the request.
     :return: Response from the webservice. True or false as a string not boolean.
     """
 
@@ -179,102 +265,141 @@ async def v_server_acpi_shutdown(login: str, password: str, vm_name: str) -> str
                "password": f"{password}",
                "vserverName": f"{vm_name}"}
 
-    soap_message = soap_message_factory(end_point="vServerACPIShutdown", variables=var_dic)
-    response = requests.post(API_URL, data=tostring(soap_message), headers=REQUEST_HEADERS)
-
-    check_for_error(response.text)
-    root = et.fromstring(response.text)
+    response_text = await post_soap_message(end_point="vServerACPIShutdown", variables=var_dic,
+                                            timeout=timeout, transport=transport)
+    root = parse_response(response_text)
     api_response = root.find(".//return")
 
     return api_response.text
 
 
-async def v_server_reset(login: str, password: str, vm_name: str) -> str:
+@traced("ncws.vServerReset")
+async def v_server_reset(login: str, password: str, vm_name: str,
+                         timeout: Optional[float] = None,
+                         transport: Optional[Transport] = None) -> str:
     """
     The Server will be reset from outside. During this process it can lead to data loss.
 
     :param login: The account login name.
     :param password: The webservice password and not account password.
     :param vm_name: The VM name and not the nickname.
+    :param timeout: (Optional) Seconds to wait for the webservice, defaults to DEFAULT_TIMEOUT.
+    :param transport: (Optional) The transport used to send the request.
     :return: Response from the webservice. True or false as a string not boolean.
     """
     var_dic = {"loginName": f"{login}",
                "password": f"{password}",
                "vserverName": f"{vm_name}"}
 
-    soap_message = soap_message_factory(end_point="vServerReset", variables=var_dic)
-    response = requests.post(API_URL, data=tostring(soap_message), headers=REQUEST_HEADERS)
-
-    check_for_error(response.text)
-    root = et.fromstring(response.text)
+    response_text = await post_soap_message(end_point="vServerReset", variables=var_dic,
+                                            timeout=timeout, transport=transport)
+    root = parse_response(response_text)
     api_response = root.find(".//return")
 
     return api_response.text
 
 
-async def v_server_acpi_reboot(login: str, password: str, vm_name: str) -> str:
+@traced("ncws.vServerACPIReboot")
+async def v_server_acpi_reboot(login: str, password: str, vm_name: str,
+                               timeout: Optional[float] = None,
+                               transport: Optional[Transport] = None) -> str:
     """
     Server is shutdown via ACPI and started after Server powered off.
 
     :param login: The account login name.
     :param password: The webservice password and not account password.
     :param vm_name: The VM name and not the nickname.
+    :param timeout: (Optional) Seconds to wait for the webservice, defaults to DEFAULT_TIMEOUT.
+    :param transport: (Optional) The transport used to send the request.
     :return: Response from the webservice. True or false as a string not boolean.
     """
     var_dic = {"loginName": f"{login}",
                "password": f"{password}",
                "vserverName": f"{vm_name}"}
 
-    soap_message = soap_message_factory(end_point="vServerACPIReboot", variables=var_dic)
-    response = requests.post(API_URL, data=tostring(soap_message), headers=REQUEST_HEADERS)
-
-    check_for_error(response.text)
-    root = et.fromstring(response.text)
+    response_text = await post_soap_message(end_point="vServerACPIReboot", variables=var_dic,
+                                            timeout=timeout, transport=transport)
+    root = parse_response(response_text)
     api_response = root.find(".//return")
 
     return api_response.text
 
 
-async def get_v_server_ips(login: str, password: str, vm_name: str) -> List[str]:
+@traced("ncws.getVServerIPs")
+async def get_v_server_ips(login: str, password: str, vm_name: str,
+                           timeout: Optional[float] = None,
+                           transport: Optional[Transport] = None) -> List[str]:
     """
     Returns a list of IP addresses for the server. This is an assumption as test server only has a single IP.
 
     :param login: The account login name.
     :param password: The webservice password and not account password.
     :param vm_name: The VM name and not the nickname.
+    :param timeout: (Optional) Seconds to wait for the webservice, defaults to DEFAULT_TIMEOUT.
+    :param transport: (Optional) The transport used to send the request.
     :return: List of IPs.
     """
     var_dic = {"loginName": f"{login}",
                "password": f"{password}",
                "vserverName": f"{vm_name}"}
 
-    soap_message = soap_message_factory(end_point="getVServerIPs", variables=var_dic)
-    response = requests.post(API_URL, data=tostring(soap_message), headers=REQUEST_HEADERS)
-
-    check_for_error(response.text)
-    root = et.fromstring(response.text)
+    response_text = await post_soap_message(end_point="getVServerIPs", variables=var_dic,
+                                            timeout=timeout, transport=transport)
+    root = parse_response(response_text)
     ip_list = root.findall(".//return")
 
     return [element.text for element in ip_list]
 
 
-def check_for_error(soap_response: str) -> None:
+@traced("ncws.getVServerInformation")
+async def get_v_server_information(login: str, password: str, vm_name: str,
+                                   timeout: Optional[float] = None,
+                                   transport: Optional[Transport] = None) -> dict[str, Any]:
     """
-    Checks if the response from the webservice is an error.
-    If it is then an exception is raised using the exception_factory function.
+    Returns the nickname, state and IPs of the server in a single request.
+    Unlike the other endpoints the WSDL names the server parameter vservername in lower case.
 
-    :param soap_response: The response returned from the API call.
-    :return: None.
+    :param login: The account login name.
+    :param password: The webservice password and not account password.
+    :param vm_name: The VM name and not the nickname.
+    :param timeout: (Optional) Seconds to wait for the webservice, defaults to DEFAULT_TIMEOUT.
+    :param transport: (Optional) The transport used to send the request.
+    :return: A dictionary with the nickname, state (online/offline) and list of IPs.
+             Empty strings if the nickname or state are not available.
     """
-    root = et.fromstring(soap_response)
-    fault_string = root.find(".//faultstring")
-    if fault_string is not None:
-        exception_factory(fault_string.text)
+    var_dic = {"loginName": f"{login}",
+               "password": f"{password}",
+               "vservername": f"{vm_name}"}
+
+    response_text = await post_soap_message(end_point="getVServerInformation", variables=var_dic,
+                                            timeout=timeout, transport=transport)
+    root = parse_response(response_text)
+    information = root.find(".//return")
+    if information is None:
+        raise ServiceException(f"Error processing request - no server information returned for {vm_name}")
+
+    return {"nickname": information.findtext("vServerNickname", default=""),
+            "state": information.findtext("status", default=""),
+            "ips": [element.text for element in information.findall("ips")]}
 
 
 EXCEPTIONS = {"validation error": ValidationException,
               "action not allowed": NotAllowedException}
 
+UNSUPPORTED_OPERATION_FAULTS = ("cannot find dispatch method", "no such operation", "unknown operation",
+                                "operation not found", "method not found", "undefined operation")
+
+
+def is_unsupported_operation(exception: ServiceException) -> bool:
+    """
+    Checks whether a webservice error means the endpoint does not exist, rather than a failure of one request.
+
+    :param exception: The exception raised for the webservice error.
+    :return: True if the endpoint is not supported by the webservice.
+    """
+    message = exception.message.lower()
+    return any(fault in message for fault in UNSUPPORTED_OPERATION_FAULTS)
+
 
 def exception_factory(fault_string: str) -> None:
     """
@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from iaas.client import Client, client_factory
+from iaas.enums import Providers
+from iaas.vm import VirtualMachine
+
+"""
+Runs a monitor across a pool of worker processes.
+
+The coordinator lists the fleet of each client spec once, and partitions it by a stable hash of
+(provider, account, vm_id) so each VM is always handled by the same worker. Each worker is sent the VMs of its shard,
+and runs its own event loop with its own clients to call the handler for them, so the provider is only asked for
+the fleet once however many workers there are. Results and metrics are returned to the coordinator.
+A client, listing or worker that fails is reported in the errors of the result, the other shards are still returned.
+
+The handler and its results are sent between processes so must be picklable. The handler must be a module level
+async function, and scripts using the runner must be guarded by if __name__ == "__main__".
+"""
+
+
+@dataclass(frozen=True)
+class ClientSpec:
+    """ The provider account a worker should create a client for """
+
+    provider: Providers
+    account: str
+    config_path: Optional[str] = None
+
+
+@dataclass
+class ShardMetrics:
+    """ Work done by a single worker """
+
+    shard: int
+    pid: int
+    vms: int = 0
+    errors: int = 0
+    elapsed: float = 0.0
+    cpu_time: float = 0.0
+
+
+@dataclass
+class ShardResult:
+    """ The handler results, errors and metrics of a single worker """
+
+    metrics: ShardMetrics
+    results: List[Any] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+
+
+@dataclass
+class RunResult:
+    """ The results of all workers aggregated by the coordinator """
+
+    results: List[Any]
+    errors: List[str]
+    shards: List[ShardMetrics]
+    elapsed: float
+
+    @property
+    def vms(self) -> int:
+        return sum(shard.vms for shard in self.shards)
+
+    @property
+    def cpu_time(self) -> float:
+        return sum(shard.cpu_time for shard in self.shards)
+
+
+@dataclass(frozen=True)
+class _ShardJob:
+    """ Everything a worker process needs to run its shard """
+
+    shard: int
+    vms: Dict[ClientSpec, List[VirtualMachine]]
+    handler: Callable[[VirtualMachine, Client], Awaitable[Any]]
+    concurrency: int
+
+
+def shard_of(provider: Providers, account: str, vm_id: str, shard_count: int) -> int:
+    """
+    Returns the shard a VM belongs to. Stable across processes and runs, unlike the builtin hash.
+
+    :param provider: The provider of the VM.
+    :param account: The account the VM belongs to.
+    :param vm_id: The id of the VM.
+    :param shard_count: The number of shards.
+    :return: The shard index.
+    """
+    digest = hashlib.blake2b(f"{provider.name}/{account}/{vm_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+class ShardedRunner:
+    """
+    Calls the handler for every VM of every client spec, spread across a pool of worker processes.
+
+    Usage:
+        async def monitor_vm(vm, client):
+            if vm.state == "STOPPED":
+                return await client.start_vm(vm)
+
+        if __name__ == "__main__":
+            runner = ShardedRunner([ClientSpec(Providers.NETCUP, "account-1")], monitor_vm, workers=4)
+            result = runner.run()
+    """
+
+    def __init__(self, specs: List[ClientSpec], handler: Callable[[VirtualMachine, Client], Awaitable[Any]],
+                 workers: Optional[int] = None, concurrency: int = 100):
+        self._specs = list(specs)
+        self._handler = handler
+        self._workers = workers if workers else os.cpu_count() or 1
+        self._concurrency = concurrency
+
+    def run(self) -> RunResult:
+        """
+        Lists the fleet, runs every shard and waits for them to finish.
+        Must not be called from a running event loop, use run_async instead.
+
+        :return: The aggregated results of all workers.
+        """
+        start = time.monotonic()
+        listings = asyncio.run(_list_fleets(self._specs))
+        shards = [{spec: [] for spec in self._specs} for _ in range(self._workers)]
+        for spec, (vms, _) in zip(self._specs, listings):
+            for vm in vms:
+                shards[shard_of(spec.provider, spec.account, vm.vm_id, self._workers)][spec].append(vm)
+        jobs = [_ShardJob(shard, vms, self._handler, self._concurrency) for shard, vms in enumerate(shards)]
+
+        # spawn so workers do not inherit the event loop or open connections of the coordinator
+        with ProcessPoolExecutor(max_workers=self._workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(_run_shard, job) for job in jobs]
+            shard_results = [_shard_result(job, future) for job, future in zip(jobs, futures)]
+
+        return RunResult(results=[result for shard in shard_results for result in shard.results],
+                         errors=[error for _, error in listings if error is not None] +
+                                [error for shard in shard_results for error in shard.errors],
+                         shards=[shard.metrics for shard in shard_results],
+                         elapsed=time.monotonic() - start)
+
+    async def run_async(self) -> RunResult:
+        """
+        Runs every shard without blocking the calling event loop.
+
+        :return: The aggregated results of all workers.
+        """
+        return await asyncio.to_thread(self.run)
+
+
+def _shard_result(job: _ShardJob, future: Future) -> ShardResult:
+    """
+    Waits for a worker. A worker that failed is reported as an error so the other shards are still returned.
+
+    :param job: The shard the worker was running.
+    :param future: The future of the worker.
+    :return: The results of the shard.
+    """
+    try:
+        return future.result()
+    except Exception as e:
+        return ShardResult(metrics=ShardMetrics(shard=job.shard, pid=0, errors=1),
+                           errors=[f"Shard {job.shard} failed - {e!r}"])
+
+
+def _run_shard(job: _ShardJob) -> ShardResult:
+    """
+    Entry point of a worker process.
+
+    :param job: The shard to run.
+    :return: The results of the shard.
+    """
+    start, cpu_start = time.monotonic(), time.process_time()
+    shard_result = asyncio.run(_run_shard_async(job))
+    shard_result.metrics.elapsed = time.monotonic() - start
+    shard_result.metrics.cpu_time = time.process_time() - cpu_start
+    return shard_result
+
+
+async def _list_fleets(specs: List[ClientSpec]) -> List[Tuple[List[VirtualMachine], Optional[str]]]:
+    """
+    Lists the fleet of every client spec at once.
+
+    :param specs: The client specs to list.
+    :return: The VMs listed for each spec, and the error that stopped the listing if any.
+    """
+    async def list_fleet(spec: ClientSpec) -> Tuple[List[VirtualMachine], Optional[str]]:
+        vms = []
+        try:
+            client = client_factory(spec.provider, spec.config_path)
+            async for vm in client.iter_vms():
+                vms.append(vm)
+        except Exception as e:
+            # a failure while listing only loses the rest of this spec, the VMs already listed are still handled
+            return vms, f"{spec.provider.name} {spec.account} - {e!r}"
+        return vms, None
+
+    return await asyncio.gather(*[list_fleet(spec) for spec in specs])
+
+
+async def _run_shard_async(job: _ShardJob) -> ShardResult:
+    shard_result = ShardResult(metrics=ShardMetrics(shard=job.shard, pid=os.getpid()))
+    semaphore = asyncio.Semaphore(job.concurrency)
+
+    async def handle(vm: VirtualMachine, client: Client) -> None:
+        try:
+            shard_result.results.append(await job.handler(vm, client))
+        except Exception as e:
+            shard_result.metrics.errors += 1
+            shard_result.errors.append(f"{vm.provider.name} {vm.vm_id} - {e}")
+        finally:
+            semaphore.release()
+
+    async def run_spec(spec: ClientSpec, vms: List[VirtualMachine]) -> None:
+        tasks = []
+        try:
+            client = client_factory(spec.provider, spec.config_path)
+            for vm in vms:
+                shard_result.metrics.vms += 1
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(handle(vm, client)))
+        except Exception as e:
+            shard_result.metrics.errors += 1
+            shard_result.errors.append(f"{spec.provider.name} {spec.account} - {e!r}")
+        finally:
+            await asyncio.gather(*tasks)
+
+    await asyncio.gather(*[run_spec(spec, vms) for spec, vms in job.vms.items() if vms])
+    return shard_result
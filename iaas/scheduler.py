@@ -0,0 +1,272 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, Iterator, List, Optional, TypeVar
+
+from iaas import exceptions as iaas_ex
+from iaas.deadline import remaining
+from iaas.enums import Priority
+from iaas.transport import DEFAULT_TRANSPORT, Transport
+from iaas.vm import VirtualMachine, VmFilter
+
+"""
+A central scheduler for provider calls.
+
+Calls are queued by priority and run highest priority first. Within a priority the queued calls are shared
+round robin across keys, eg (provider, account), so one busy account cannot starve the others.
+
+Scheduling is applied per provider request by ScheduledTransport, so an urgent action only waits for a free
+slot and not for every request of a large refresh that was queued before it.
+
+Time spent queued counts against the current iaas.deadline, a call still queued when it is reached is removed
+from the queue and raises DeadlineExceeded.
+"""
+T = TypeVar("T")
+
+_priority: ContextVar[Optional[Priority]] = ContextVar("iaas_priority", default=None)
+
+
+@contextmanager
+def priority(level: Priority) -> Iterator[None]:
+    """
+    Sets the priority of all provider calls made within the context.
+
+    :param level: The priority.
+    :return: None
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority(default: Priority = Priority.USER) -> Priority:
+    """
+    Returns the priority set for the current context.
+
+    :param default: (Optional) The priority to use if none has been set.
+    :return: The priority.
+    """
+    level = _priority.get()
+    return level if level is not None else default
+
+
+@dataclass
+class SchedulerStats:
+    """ Queue depth and throughput of a scheduler """
+
+    running: int
+    queued: dict[Priority, int]
+    queued_by_key: dict[Hashable, int]
+    running_by_key: dict[Hashable, int]
+    completed: int
+    max_wait: dict[Priority, float] = field(default_factory=dict)
+
+
+class _Waiter:
+    """ A call waiting for a slot """
+
+    def __init__(self, key: Hashable, future: asyncio.Future):
+        self.key = key
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class Scheduler:
+    """
+    Limits the number of concurrent provider calls and decides which queued call runs next.
+
+    Slots are reserved for EMERGENCY calls so recovery actions never wait behind background work.
+    """
+
+    def __init__(self, max_concurrency: int = 10, reserved_for_emergency: int = 1,
+                 max_per_key: Optional[int] = None):
+        self._max_concurrency = max_concurrency
+        self._reserved_for_emergency = min(reserved_for_emergency, max_concurrency - 1)
+        self._max_per_key = max_per_key
+        self._queues = {level: OrderedDict() for level in Priority}
+        self._running_by_key = {}
+        self._running = 0
+        self._completed = 0
+        self._max_wait = {level: 0.0 for level in Priority}
+
+    async def run(self, func: Callable[[], Awaitable[T]], level: Optional[Priority] = None,
+                  key: Hashable = "default") -> T:
+        """
+        Waits for a slot then runs the call. Raises DeadlineExceeded if the current iaas.deadline is reached first.
+
+        :param func: A function returning the awaitable to run, eg lambda: client.start_vm(vm).
+        :param level: (Optional) The priority, defaults to the priority of the current context.
+        :param key: (Optional) The key calls are shared across, eg (provider, account).
+        :return: The result of the call.
+        """
+        level = level if level is not None else current_priority()
+        await self._acquire(level, key)
+        try:
+            return await func()
+        finally:
+            self._release(key)
+
+    def stats(self) -> SchedulerStats:
+        """
+        Returns the current queue depths and counters.
+
+        :return: SchedulerStats
+        """
+        queued_by_key = {}
+        for queues in self._queues.values():
+            for key, waiters in queues.items():
+                queued_by_key[key] = queued_by_key.get(key, 0) + len(waiters)
+
+        return SchedulerStats(running=self._running,
+                              queued={level: sum(len(w) for w in queues.values())
+                                      for level, queues in self._queues.items()},
+                              queued_by_key=queued_by_key,
+                              running_by_key=dict(self._running_by_key),
+                              completed=self._completed,
+                              max_wait=dict(self._max_wait))
+
+    async def _acquire(self, level: Priority, key: Hashable) -> None:
+        waiter = _Waiter(key, asyncio.get_running_loop().create_future())
+        self._queues[level].setdefault(key, deque()).append(waiter)
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(waiter.future, remaining())
+        except asyncio.TimeoutError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # the slot was granted in the same iteration as the timeout, hand it on
+                self._release(key)
+            else:
+                self._remove(level, waiter)
+            raise iaas_ex.DeadlineExceeded(
+                f"Deadline exceeded after {time.monotonic() - waiter.queued_at:.3f}s waiting for a slot") from None
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # the slot was granted as the caller was cancelled, hand it on
+                self._release(key)
+            else:
+                self._remove(level, waiter)
+            raise
+
+        self._max_wait[level] = max(self._max_wait[level], time.monotonic() - waiter.queued_at)
+
+    def _release(self, key: Hashable) -> None:
+        self._running -= 1
+        self._completed += 1
+        self._running_by_key[key] -= 1
+        if not self._running_by_key[key]:
+            del self._running_by_key[key]
+        self._dispatch()
+
+    def _remove(self, level: Priority, waiter: _Waiter) -> None:
+        waiters = self._queues[level].get(waiter.key)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._queues[level][waiter.key]
+
+    def _dispatch(self) -> None:
+        while self._running < self._max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+
+            self._running += 1
+            self._running_by_key[waiter.key] = self._running_by_key.get(waiter.key, 0) + 1
+            waiter.future.set_result(None)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for level in Priority:
+            if level != Priority.EMERGENCY and \
+                    self._running >= self._max_concurrency - self._reserved_for_emergency:
+                return None
+
+            queues = self._queues[level]
+            for _ in range(len(queues)):
+                key, waiters = next(iter(queues.items()))
+                # move the key to the back so the next call at this priority comes from another key
+                queues.move_to_end(key)
+                if self._max_per_key is not None and self._running_by_key.get(key, 0) >= self._max_per_key:
+                    continue
+
+                waiter = waiters.popleft()
+                if not waiters:
+                    del queues[key]
+                if waiter.future.cancelled():
+                    continue
+                return waiter
+        return None
+
+
+class ScheduledTransport:
+    """
+    Runs every provider request through a scheduler.
+    The key should identify the provider and account, eg (Providers.NETCUP, "login").
+    """
+
+    def __init__(self, scheduler: Scheduler, key: Hashable, transport: Optional[Transport] = None):
+        self._scheduler = scheduler
+        self._key = key
+        self._transport = transport if transport else DEFAULT_TRANSPORT
+
+    async def call(self, service: str, operation: str, params: dict[str, Any], func: Callable[[], Any],
+                   timeout: Optional[float] = None,
+                   encode: Optional[Callable[[Any], Any]] = None,
+                   decode: Optional[Callable[[Any], Any]] = None) -> Any:
+        return await self._scheduler.run(
+            lambda: self._transport.call(service, operation, params, func, timeout, encode, decode),
+            key=self._key)
+
+
+class ScheduledClient:
+    """
+    Sets a default priority on each client method. Listing VMs and IPs is BACKGROUND and VM actions are USER,
+    unless the caller has set a priority, eg with priority(Priority.EMERGENCY).
+
+    The wrapped client should be created with a ScheduledTransport for the priorities to take effect.
+    """
+
+    def __init__(self, client: Any):
+        self._client = client
+
+    async def get_all_vms(self, vm_filter: Optional[VmFilter] = None, timeout: Optional[float] = None,
+                          partial: bool = True) -> list[VirtualMachine]:
+        with priority(current_priority(Priority.BACKGROUND)):
+            return await self._client.get_all_vms(vm_filter, timeout, partial)
+
+    async def iter_vms(self, vm_filter: Optional[VmFilter] = None) -> AsyncIterator[VirtualMachine]:
+        level = current_priority(Priority.BACKGROUND)
+        iterator = self._client.iter_vms(vm_filter).__aiter__()
+        while True:
+            # the priority is only set while the client is fetching, not while the caller handles each VM
+            with priority(level):
+                try:
+                    vm = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+            yield vm
+
+    async def stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        with priority(current_priority(Priority.USER)):
+            return await self._client.stop_vm(vm, timeout)
+
+    async def force_stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        with priority(current_priority(Priority.USER)):
+            return await self._client.force_stop_vm(vm, timeout)
+
+    async def start_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        with priority(current_priority(Priority.USER)):
+            return await self._client.start_vm(vm, timeout)
+
+    async def restart_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        with priority(current_priority(Priority.USER)):
+            return await self._client.restart_vm(vm, timeout)
+
+    async def get_public_ips(self, vm: VirtualMachine, timeout: Optional[float] = None) -> List[str]:
+        with priority(current_priority(Priority.BACKGROUND)):
+            return await self._client.get_public_ips(vm, timeout)
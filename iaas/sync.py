@@ -0,0 +1,193 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Coroutine, Iterator, List, Optional
+
+from iaas import exceptions as iaas_ex
+from iaas.client import Client, client_factory
+from iaas.enums import Providers
+from iaas.vm import VirtualMachine, VmFilter
+
+"""
+Synchronous access to the clients for callers without an event loop, eg cron scripts and WSGI handlers.
+
+Every call is run on one long lived event loop in a background thread rather than a new loop per call, so clients,
+their connections and the worker threads used for blocking provider calls are reused. Calls can be made from any
+number of threads at once and run concurrently on the background loop.
+"""
+
+
+class BackgroundLoop:
+    """ An event loop running in a daemon thread, started on first use """
+
+    def __init__(self, name: str = "iaas-background-loop"):
+        self._name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, coroutine: Coroutine) -> Future:
+        """
+        Schedules a coroutine on the loop. Safe to call from any thread.
+
+        :param coroutine: The coroutine to run.
+        :return: A concurrent.futures.Future for the result.
+        """
+        # scheduled under the lock so stop cannot close the loop between starting it and scheduling the coroutine
+        with self._lock:
+            return asyncio.run_coroutine_threadsafe(coroutine, self._start())
+
+    def run(self, coroutine: Coroutine) -> Any:
+        """
+        Runs a coroutine on the loop and waits for the result. The coroutine is cancelled if the wait is interrupted.
+
+        :param coroutine: The coroutine to run.
+        :return: The result of the coroutine.
+        """
+        if self._thread is not None and threading.current_thread() is self._thread:
+            coroutine.close()
+            raise iaas_ex.ClientException("Synchronous client called from its own event loop, await the client instead")
+
+        future = self.submit(coroutine)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def stop(self) -> None:
+        """
+        Cancels the calls still running, stops the loop and waits for its thread to exit.
+        The loop is started again if it is used after stopping.
+
+        :return: None
+        """
+        if self._thread is not None and threading.current_thread() is self._thread:
+            raise iaas_ex.ClientException("Background loop cannot be stopped from its own thread")
+
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+
+        if loop is None:
+            return
+        # callers waiting on the cancelled calls get CancelledError rather than waiting forever
+        asyncio.run_coroutine_threadsafe(_cancel_tasks(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        """ Starts the loop if it is not running. Must be called holding the lock """
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name=self._name, daemon=True)
+            self._thread.start()
+        return self._loop
+
+
+async def _cancel_tasks() -> None:
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.get_running_loop().shutdown_asyncgens()
+
+
+class SyncClient:
+    """
+    Synchronous wrapper of an iaas.client.Client. Each method blocks until the client call on the loop completes.
+
+    Usage:
+        client = sync_client_factory(Providers.NETCUP)
+        for vm in client.get_all_vms():
+            if vm.state != "RUNNING":
+                client.start_vm(vm)
+    """
+
+    def __init__(self, client: Client, loop: Optional[BackgroundLoop] = None):
+        self.client = client
+        self._loop = loop if loop else shared_loop()
+
+    def get_all_vms(self, vm_filter: Optional[VmFilter] = None, timeout: Optional[float] = None,
+                    partial: bool = True) -> List[VirtualMachine]:
+        return self._loop.run(self.client.get_all_vms(vm_filter, timeout, partial))
+
+    def iter_vms(self, vm_filter: Optional[VmFilter] = None) -> Iterator[VirtualMachine]:
+        """
+        Yields VMs as the client returns them. The async iterator stays on the loop and is closed with the generator.
+
+        :param vm_filter: (Optional) Only yield VMs matching the filter.
+        :return: An iterator of iaas.vm.VirtualMachine
+        """
+        iterator: AsyncIterator[VirtualMachine] = self.client.iter_vms(vm_filter)
+        try:
+            while True:
+                try:
+                    yield self._loop.run(_next(iterator))
+                except StopAsyncIteration:
+                    return
+        finally:
+            if hasattr(iterator, "aclose"):
+                self._loop.run(iterator.aclose())
+
+    def stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        return self._loop.run(self.client.stop_vm(vm, timeout))
+
+    def force_stop_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        return self._loop.run(self.client.force_stop_vm(vm, timeout))
+
+    def start_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        return self._loop.run(self.client.start_vm(vm, timeout))
+
+    def restart_vm(self, vm: VirtualMachine, timeout: Optional[float] = None) -> str:
+        return self._loop.run(self.client.restart_vm(vm, timeout))
+
+    def get_public_ips(self, vm: VirtualMachine, timeout: Optional[float] = None) -> List[str]:
+        return self._loop.run(self.client.get_public_ips(vm, timeout))
+
+
+async def _next(iterator: AsyncIterator[VirtualMachine]) -> VirtualMachine:
+    return await iterator.__anext__()
+
+
+_shared_loop = BackgroundLoop()
+_clients: dict[tuple[Providers, Optional[str]], SyncClient] = {}
+_clients_lock = threading.Lock()
+
+
+def shared_loop() -> BackgroundLoop:
+    """
+    Returns the background loop used by synchronous clients unless another loop is supplied.
+
+    :return: The shared iaas.sync.BackgroundLoop
+    """
+    return _shared_loop
+
+
+def sync_client_factory(provider: Providers, config_path: Optional[str] = None) -> SyncClient:
+    """
+    Returns a synchronous client for the provider. Unlike iaas.client.client_factory the instance is kept,
+    and later calls with the same provider and config path return it, so the connections it holds are reused.
+
+    :param provider: The required provider for the service you wish to use.
+    :param config_path: (Optional) The alternate path to the config file.
+    :return: Instance of iaas.sync.SyncClient
+    """
+    key = (provider, config_path)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = SyncClient(client_factory(provider, config_path))
+        return _clients[key]
+
+
+def shutdown() -> None:
+    """
+    Forgets the kept synchronous clients and stops the shared background loop.
+
+    :return: None
+    """
+    with _clients_lock:
+        _clients.clear()
+    _shared_loop.stop()
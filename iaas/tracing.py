@@ -0,0 +1,212 @@
+import functools
+import inspect
+import json
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, Optional, Protocol
+
+from iaas import exceptions as iaas_ex
+
+"""
+Optional tracing of the factory, client and transport layers.
+
+Tracing is disabled until an exporter is set with configure(). While disabled span() and traced()
+do nothing beyond a single check so they can be left in place on hot paths.
+
+The current span is carried in a context variable so spans nest correctly across awaits, child tasks
+and worker threads started with asyncio.to_thread.
+"""
+
+
+@dataclass
+class Span:
+    """ A single timed operation """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_time: float
+    end_time: Optional[float] = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"name": self.name,
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "start_time": self.start_time,
+                "end_time": self.end_time,
+                "duration_ms": self.duration * 1000 if self.duration is not None else None,
+                "attributes": self.attributes,
+                "error": self.error}
+
+
+class SpanExporter(Protocol):
+    """ Used as an interface for all span exporters """
+
+    def on_start(self, span: Span) -> None:
+        ...
+
+    def on_end(self, span: Span) -> None:
+        ...
+
+
+class JsonFileExporter:
+    """
+    Writes each finished span as a line of JSON to a local file.
+    Child spans finish before their parent so will appear in the file first.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def on_start(self, span: Span) -> None:
+        pass
+
+    def on_end(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class OpenTelemetryExporter:
+    """
+    Mirrors spans into an OpenTelemetry tracer so they can be sent to any OpenTelemetry compatible backend.
+    Requires the opentelemetry-api package, the SDK and exporters are configured by the application as usual.
+    """
+
+    def __init__(self, tracer_name: str = "iaas"):
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise iaas_ex.ClientException(
+                "OpenTelemetryExporter requires the opentelemetry-api package to be installed") from None
+
+        self._trace = trace
+        self._tracer = trace.get_tracer(tracer_name)
+        self._open_spans = {}
+
+    def on_start(self, span: Span) -> None:
+        parent = self._open_spans.get(span.parent_id)
+        context = self._trace.set_span_in_context(parent) if parent is not None else None
+        self._open_spans[span.span_id] = self._tracer.start_span(span.name,
+                                                                 context=context,
+                                                                 attributes=span.attributes,
+                                                                 start_time=int(span.start_time * 1e9))
+
+    def on_end(self, span: Span) -> None:
+        otel_span = self._open_spans.pop(span.span_id, None)
+        if otel_span is None:
+            return
+
+        otel_span.set_attributes(span.attributes)
+        if span.error:
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=int(span.end_time * 1e9))
+
+
+_exporter: Optional[SpanExporter] = None
+_current_span: ContextVar[Optional[Span]] = ContextVar("iaas_span", default=None)
+
+
+def configure(exporter: Optional[SpanExporter]) -> None:
+    """
+    Enables tracing by setting the exporter that receives all spans. Passing None disables tracing.
+
+    :param exporter: (Optional) The exporter to send spans to.
+    :return: None
+    """
+    global _exporter
+    _exporter = exporter
+
+
+def current_span() -> Optional[Span]:
+    """
+    Returns the span currently active in this context.
+
+    :return: The current span. None if tracing is disabled or there is no active span.
+    """
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Times the code within the context as a span, nested under the current span.
+
+    :param name: The name of the operation.
+    :param attributes: Any attributes to record against the span.
+    :return: The span. None if tracing is disabled.
+    """
+    exporter = _exporter
+    if exporter is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    new_span = Span(name=name,
+                    trace_id=parent.trace_id if parent else secrets.token_hex(16),
+                    span_id=secrets.token_hex(8),
+                    parent_id=parent.span_id if parent else None,
+                    start_time=time.time(),
+                    attributes=attributes)
+    exporter.on_start(new_span)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        new_span.end_time = time.time()
+        exporter.on_end(new_span)
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator that records each call of a function or coroutine function as a span.
+
+    :param name: The name of the operation.
+    :return: The decorated function.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _exporter is None:
+                    return await func(*args, **kwargs)
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _exporter is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
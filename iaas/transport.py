@@ -0,0 +1,129 @@
+import inspect
+import json
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable, Optional, Protocol
+
+from iaas import exceptions as iaas_ex
+from iaas.deadline import run_async, run_blocking, sleep
+
+"""
+Transports sit underneath the provider clients and perform the actual call to the provider.
+
+Each call is described by the service, the operation and the parameters that identify the request.
+Parameters must not include credentials as they are written to the cassette when recording.
+
+The call itself is a function without arguments. It is normally a blocking function, such as an HTTP request,
+and may be a coroutine function for calls that are already asynchronous, such as the simulated provider.
+
+A cassette is a file with one recorded exchange per line of JSON, so it can be written as calls complete.
+"""
+
+
+class Transport(Protocol):
+    """ Used as an interface for all transports """
+
+    async def call(self, service: str, operation: str, params: dict[str, Any], func: Callable[[], Any],
+                   timeout: Optional[float] = None,
+                   encode: Optional[Callable[[Any], Any]] = None,
+                   decode: Optional[Callable[[Any], Any]] = None) -> Any:
+        ...
+
+
+def exchange_key(service: str, operation: str, params: dict[str, Any]) -> str:
+    """
+    Returns the key used to match a request to a recorded exchange.
+
+    :param service: The provider service, eg netcup or oracle.
+    :param operation: The API operation.
+    :param params: The parameters identifying the request.
+    :return: The key.
+    """
+    return json.dumps([service, operation, params], sort_keys=True, default=str)
+
+
+class DirectTransport:
+    """
+    Calls the provider. Blocking calls are run in a worker thread bounded by the timeout and current iaas.deadline,
+    coroutine functions are awaited on the event loop with the same bound.
+    """
+
+    async def call(self, service: str, operation: str, params: dict[str, Any], func: Callable[[], Any],
+                   timeout: Optional[float] = None,
+                   encode: Optional[Callable[[Any], Any]] = None,
+                   decode: Optional[Callable[[Any], Any]] = None) -> Any:
+        if inspect.iscoroutinefunction(func):
+            return await run_async(func, timeout=timeout)
+        return await run_blocking(func, timeout=timeout)
+
+
+class RecordingTransport:
+    """
+    Passes each call to another transport and appends the request, response and timing to a cassette.
+    Only successful calls are recorded.
+    """
+
+    def __init__(self, path: str, transport: Optional[Transport] = None):
+        self._transport = transport if transport else DirectTransport()
+        self._file = open(path, "a", encoding="utf-8")
+
+    async def call(self, service: str, operation: str, params: dict[str, Any], func: Callable[[], Any],
+                   timeout: Optional[float] = None,
+                   encode: Optional[Callable[[Any], Any]] = None,
+                   decode: Optional[Callable[[Any], Any]] = None) -> Any:
+        start = time.monotonic()
+        result = await self._transport.call(service, operation, params, func, timeout, encode, decode)
+        elapsed = time.monotonic() - start
+
+        exchange = {"service": service,
+                    "operation": operation,
+                    "params": params,
+                    "elapsed": elapsed,
+                    "response": encode(result) if encode else result}
+        self._file.write(json.dumps(exchange, default=str) + "\n")
+        self._file.flush()
+        return result
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ReplayTransport:
+    """
+    Serves responses from a cassette without any network access.
+
+    Each response is delayed by its recorded latency multiplied by latency_scale, 0 returns immediately.
+    Identical requests are served in the order they were recorded.
+    """
+
+    def __init__(self, path: str, latency_scale: float = 1.0):
+        self._latency_scale = latency_scale
+        self._exchanges = defaultdict(deque)
+
+        try:
+            with open(path, encoding="utf-8") as cassette:
+                for line in cassette:
+                    if line.strip():
+                        exchange = json.loads(line)
+                        key = exchange_key(exchange["service"], exchange["operation"], exchange["params"])
+                        self._exchanges[key].append(exchange)
+        except FileNotFoundError:
+            raise iaas_ex.ClientException(f"Unable to locate cassette file {path}") from None
+
+    async def call(self, service: str, operation: str, params: dict[str, Any], func: Callable[[], Any],
+                   timeout: Optional[float] = None,
+                   encode: Optional[Callable[[Any], Any]] = None,
+                   decode: Optional[Callable[[Any], Any]] = None) -> Any:
+        recorded = self._exchanges.get(exchange_key(service, operation, params))
+        if not recorded:
+            raise iaas_ex.ClientException(f"No recorded response for {service} {operation} {params}")
+
+        exchange = recorded.popleft()
+        try:
+            await sleep(exchange["elapsed"] * self._latency_scale, timeout)
+        except iaas_ex.DeadlineExceeded:
+            raise iaas_ex.DeadlineExceeded(f"Deadline exceeded waiting for replayed {service} {operation}") from None
+        return decode(exchange["response"]) if decode else exchange["response"]
+
+
+DEFAULT_TRANSPORT = DirectTransport()
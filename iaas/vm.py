@@ -1,4 +1,7 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+from typing import Callable, Collection, List, Optional
 
 from iaas.enums import Providers
 
@@ -23,11 +26,16 @@ class VirtualMachine:
     vm_id: str
     state: str
     provider: Providers
+    public_ips: Optional[List[str]] = None
+    fetched_at: Optional[datetime] = field(default=None, compare=False)
 
-    def __init__(self, display_name: str, vm_id: str, state: str, provider: Providers):
+    def __init__(self, display_name: str, vm_id: str, state: str, provider: Providers,
+                 public_ips: Optional[List[str]] = None):
         self.vm_id = vm_id
         self.display_name = display_name
         self.provider = provider
+        self.public_ips = public_ips
+        self.fetched_at = datetime.now(timezone.utc)
         self.set_state(state)
 
     def set_state(self, state: str) -> None:
@@ -35,3 +43,38 @@ class VirtualMachine:
             self.state = VM_STATES.get(state)
         else:
             raise ValueError from None
+
+
+@dataclass
+class VmFilter:
+    """
+    Criteria used to limit the VMs returned by a client. Unset criteria match every VM.
+
+    States use the consistent names from VM_STATES eg RUNNING or STOPPED.
+    The name pattern is matched against the display name using shell style wildcards eg web-*.
+    The id predicate is checked before any VM details are fetched, eg to select a shard of the fleet.
+    """
+
+    states: Optional[Collection[str]] = None
+    name_pattern: Optional[str] = None
+    vm_ids: Optional[Collection[str]] = None
+    id_predicate: Optional[Callable[[str], bool]] = None
+
+    def match_id(self, vm_id: str) -> bool:
+        return (self.vm_ids is None or vm_id in self.vm_ids) and (self.id_predicate is None or self.id_predicate(vm_id))
+
+    def match_state(self, state: str) -> bool:
+        return self.states is None or VM_STATES.get(state, state) in self.states
+
+    def match_name(self, display_name: Optional[str]) -> bool:
+        return self.name_pattern is None or fnmatchcase(display_name or "", self.name_pattern)
+
+    def matches(self, vm: VirtualMachine) -> bool:
+        return self.match_id(vm.vm_id) and self.match_state(vm.state) and self.match_name(vm.display_name)
+
+    @property
+    def exact_name(self) -> Optional[str]:
+        """ The name pattern if it contains no wildcards and can be matched exactly """
+        if self.name_pattern is not None and not any(char in self.name_pattern for char in "*?["):
+            return self.name_pattern
+        return None
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from iaas.concurrency import bounded_as_completed
+
+
+def test_limits_lookups_in_flight():
+    async def main():
+        running, peak = 0, 0
+
+        async def lookup(index: int) -> int:
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.001 * (index % 3))
+            running -= 1
+            return index
+
+        results = [result async for result in bounded_as_completed((lookup(i) for i in range(50)), 5)]
+        return results, peak
+
+    results, peak = asyncio.run(main())
+    assert sorted(results) == list(range(50))
+    assert peak == 5
+
+
+def test_slow_caller_holds_back_lookups():
+    async def main():
+        started = []
+
+        async def lookup(index: int) -> int:
+            started.append(index)
+            return index
+
+        iterator = bounded_as_completed((lookup(i) for i in range(100)), 4)
+        await iterator.__anext__()
+        # the caller is busy, nothing more may start however long it takes
+        await asyncio.sleep(0.01)
+        count = len(started)
+        await iterator.aclose()
+        return count
+
+    assert asyncio.run(main()) == 4
+
+
+def test_stopping_early_cancels_lookups():
+    async def main():
+        cancelled = []
+
+        async def lookup(index: int) -> int:
+            try:
+                await asyncio.sleep(0 if index == 0 else 10)
+            except asyncio.CancelledError:
+                cancelled.append(index)
+                raise
+            return index
+
+        iterator = bounded_as_completed((lookup(i) for i in range(10)), 3)
+        first = await iterator.__anext__()
+        await iterator.aclose()
+        await asyncio.sleep(0)
+        return first, sorted(cancelled)
+
+    assert asyncio.run(main()) == (0, [1, 2])
+
+
+def test_error_is_raised_to_caller():
+    async def main():
+        async def lookup(index: int) -> int:
+            if index == 3:
+                raise ValueError("lookup failed")
+            return index
+
+        return [result async for result in bounded_as_completed((lookup(i) for i in range(10)), 2)]
+
+    with pytest.raises(ValueError):
+        asyncio.run(main())
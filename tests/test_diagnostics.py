@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+from iaas.clients.netcup import NetcupClient
+from iaas.diagnostics import BlockingDetector
+
+
+class _BlockingWebservice:
+    """ Answers the webservice calls of the client, blocking the event loop for the lookups of the VM ids given """
+
+    def __init__(self, vm_count: int, blocking: dict[str, float]):
+        self._vm_ids = [f"v{index}" for index in range(vm_count)]
+        self._blocking = blocking
+
+    async def call(self, service, operation, params, func, timeout=None, encode=None, decode=None):
+        if operation == "getVServers":
+            return "<Envelope>" + "".join(f"<return>{vm_id}</return>" for vm_id in self._vm_ids) + "</Envelope>"
+
+        vm_id = params["vservername"]
+        # the regression being caught, a blocking call made on the event loop
+        time.sleep(self._blocking.get(vm_id, 0))
+        await asyncio.sleep(0)
+        return (f"<Envelope><return><vServerNickname>{vm_id}</vServerNickname><status>online</status>"
+                f"<ips>10.0.0.1</ips></return></Envelope>")
+
+
+def test_reports_blocking_in_tasks_created_by_the_client(tmp_path):
+    path = tmp_path / "netcup.ini"
+    path.write_text("[DEFAULT]\nloginName=1\npassword=secret\n")
+    webservice = _BlockingWebservice(10, {"v2": 0.2, "v7": 0.2})
+
+    async def main():
+        detector = BlockingDetector(threshold=0.1)
+        detector.start()
+        try:
+            client = detector.instrument(NetcupClient(str(path), webservice))
+            vms = await client.get_all_vms()
+        finally:
+            detector.stop()
+        return vms, list(detector.reports)
+
+    vms, reports = asyncio.run(main())
+    assert len(vms) == 10
+    # each blocking lookup is reported once, against the task running it and not the client method as well
+    assert len(reports) == 2
+    assert all("_lookup_vm" in report.function for report in reports)
+    assert all(report.duration >= 0.2 for report in reports)
+    assert any("time.sleep" in line or "sleep(" in line for line in reports[0].stack)
+
+
+def test_restores_task_factory_on_stop():
+    async def main():
+        loop = asyncio.get_running_loop()
+        detector = BlockingDetector()
+        detector.start()
+        installed = loop.get_task_factory() is not None
+        detector.stop()
+        return installed, loop.get_task_factory()
+
+    assert asyncio.run(main()) == (True, None)
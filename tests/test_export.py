@@ -0,0 +1,98 @@
+import asyncio
+import csv
+import io
+import json
+
+import pytest
+
+from iaas import exceptions as iaas_ex
+from iaas.enums import Providers
+from iaas.export import FIELDS, ArrowWriter, CsvWriter, NdjsonWriter, ParquetWriter, export_vms
+from iaas.vm import VirtualMachine
+
+
+def _vms() -> list[VirtualMachine]:
+    return [VirtualMachine(display_name="web-1", vm_id="a", state="RUNNING", provider=Providers.SIMULATED,
+                           public_ips=["10.0.0.1", "10.0.0.2"]),
+            VirtualMachine(display_name="web-2", vm_id="b", state="STOPPED", provider=Providers.SIMULATED,
+                           public_ips=[]),
+            VirtualMachine(display_name="db-1", vm_id="c", state="RUNNING", provider=Providers.ORACLE)]
+
+
+async def _iterate(vms: list[VirtualMachine]):
+    for vm in vms:
+        yield vm
+
+
+class _IpClient:
+    """ Answers get_public_ips, failing for the VM ids given """
+
+    def __init__(self, failing: tuple[str, ...] = ()):
+        self.calls = []
+        self._failing = failing
+
+    async def get_public_ips(self, vm: VirtualMachine, timeout=None) -> list[str]:
+        self.calls.append(vm.vm_id)
+        if vm.vm_id in self._failing:
+            raise iaas_ex.ProviderError("lookup failed")
+        return [f"192.168.0.{len(self.calls)}"]
+
+
+def test_ndjson_writes_unknown_ips_as_null():
+    output = io.StringIO()
+    count = asyncio.run(export_vms(_iterate(_vms()), NdjsonWriter(output)))
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    assert count == 3
+    assert [record["public_ips"] for record in records] == [["10.0.0.1", "10.0.0.2"], [], None]
+    assert list(records[0]) == list(FIELDS)
+    assert records[2]["provider"] == "ORACLE"
+
+
+def test_csv_writes_header_and_joined_ips():
+    output = io.StringIO()
+    asyncio.run(export_vms(_iterate(_vms()), CsvWriter(output)))
+    rows = list(csv.reader(io.StringIO(output.getvalue())))
+
+    assert rows[0] == list(FIELDS)
+    assert [row[FIELDS.index("public_ips")] for row in rows[1:]] == ["10.0.0.1;10.0.0.2", "", ""]
+
+
+def test_fetches_missing_ips_with_ip_clients():
+    output, client = io.StringIO(), _IpClient()
+    vms = _vms() + [VirtualMachine(display_name=f"db-{index}", vm_id=f"c{index}", state="RUNNING",
+                                   provider=Providers.ORACLE) for index in range(5)]
+    asyncio.run(export_vms(_iterate(vms), NdjsonWriter(output), ip_clients={Providers.ORACLE: client},
+                           max_in_flight=2))
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    assert sorted(client.calls) == sorted(["c"] + [f"c{index}" for index in range(5)])
+    assert all(record["public_ips"] for record in records if record["provider"] == "ORACLE")
+    assert len(records) == 8
+
+
+def test_failed_ip_lookup_is_exported_as_unknown():
+    output = io.StringIO()
+    asyncio.run(export_vms(_iterate(_vms()), NdjsonWriter(output),
+                           ip_clients={Providers.ORACLE: _IpClient(failing=("c",))}))
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    assert records[2]["vm_id"] == "c"
+    assert records[2]["public_ips"] is None
+
+
+@pytest.mark.parametrize("writer_class", [ParquetWriter, ArrowWriter])
+def test_columnar_writers(tmp_path, writer_class):
+    pa = pytest.importorskip("pyarrow")
+    path = str(tmp_path / "inventory")
+    asyncio.run(export_vms(_iterate(_vms()), writer_class(path, batch_size=2)))
+
+    if writer_class is ParquetWriter:
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+    else:
+        with pa.OSFile(path, "rb") as source:
+            table = pa.ipc.open_stream(source).read_all()
+
+    assert table.column_names == list(FIELDS)
+    assert table.column("public_ips").to_pylist() == [["10.0.0.1", "10.0.0.2"], [], None]
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import sqlite3
+import time
+
+import pytest
+
+from iaas import exceptions as iaas_ex
+from iaas.enums import Providers
+from iaas.journal import ActionJournal, JournaledClient, SqliteActionJournal, current_retry_token
+from iaas.vm import VirtualMachine
+
+
+class _Provider:
+    """ Records the actions that reach the provider """
+
+    def __init__(self):
+        self.calls = []
+
+    async def action(self, name: str, result: str) -> str:
+        self.calls.append(name)
+        return result
+
+
+def _vm() -> VirtualMachine:
+    return VirtualMachine(display_name="vm", vm_id="vm-1", state="RUNNING", provider=Providers.SIMULATED)
+
+
+async def _start_stop_start(journal: ActionJournal, provider: _Provider) -> list[str]:
+    vm = _vm()
+    return [await journal.run(vm, "start", lambda: provider.action("start", "STARTING")),
+            await journal.run(vm, "stop", lambda: provider.action("stop", "STOPPING")),
+            await journal.run(vm, "start", lambda: provider.action("start", "STARTING"))]
+
+
+def test_duplicate_within_ttl_is_not_sent():
+    async def main():
+        journal, provider = ActionJournal(ttl=60), _Provider()
+        vm = _vm()
+        results = [await journal.run(vm, "start", lambda: provider.action("start", "STARTING")) for _ in range(2)]
+        return results, provider.calls
+
+    results, calls = asyncio.run(main())
+    assert results == ["STARTING", "STARTING"]
+    assert calls == ["start"]
+
+
+def test_start_after_stop_is_sent():
+    provider = _Provider()
+    results = asyncio.run(_start_stop_start(ActionJournal(ttl=60), provider))
+    assert results == ["STARTING", "STOPPING", "STARTING"]
+    assert provider.calls == ["start", "stop", "start"]
+
+
+def test_start_after_stop_is_sent_with_sqlite_journal(tmp_path):
+    provider = _Provider()
+    path = str(tmp_path / "actions.db")
+    asyncio.run(_start_stop_start(SqliteActionJournal(path, ttl=60), provider))
+
+    # a second process sees the stop as the last action and must not answer a start from the first start
+    other = _Provider()
+    vm = _vm()
+    result = asyncio.run(SqliteActionJournal(path, ttl=60).run(vm, "stop", lambda: other.action("stop", "STOPPING")))
+    assert provider.calls == ["start", "stop", "start"]
+    assert result == "STOPPING"
+    assert other.calls == ["stop"]
+
+
+def test_duplicate_takes_over_when_original_is_cancelled():
+    async def main():
+        journal, provider = ActionJournal(ttl=60), _Provider()
+        vm = _vm()
+        sent = asyncio.Event()
+        tokens = []
+
+        async def slow_start() -> str:
+            tokens.append(current_retry_token())
+            provider.calls.append("start")
+            sent.set()
+            await asyncio.sleep(0.05)
+            return "STARTING"
+
+        original = asyncio.create_task(journal.run(vm, "start", slow_start))
+        await sent.wait()
+        duplicate = asyncio.create_task(journal.run(vm, "start", slow_start))
+        await asyncio.sleep(0)
+        original.cancel()
+
+        result = await duplicate
+        return original.cancelled(), duplicate.cancelled(), result, provider.calls, tokens
+
+    original_cancelled, duplicate_cancelled, result, calls, tokens = asyncio.run(main())
+    assert original_cancelled
+    assert not duplicate_cancelled
+    assert result == "STARTING"
+    assert calls == ["start", "start"]
+    # the retried request reuses the token so the provider can recognise it
+    assert tokens[0] is not None and tokens[0] == tokens[1]
+
+
+class _Client:
+    """ A client whose start takes the delay given """
+
+    def __init__(self, delay: float):
+        self.calls = []
+        self._delay = delay
+
+    async def start_vm(self, vm: VirtualMachine, timeout=None) -> str:
+        self.calls.append("start")
+        await asyncio.sleep(self._delay)
+        return "STARTING"
+
+
+def test_duplicate_waits_no_longer_than_its_timeout():
+    async def main():
+        provider = _Client(0.5)
+        client = JournaledClient(provider, ActionJournal(ttl=60))
+        vm = _vm()
+        original = asyncio.create_task(client.start_vm(vm))
+        await asyncio.sleep(0)
+
+        started = time.monotonic()
+        with pytest.raises(iaas_ex.DeadlineExceeded):
+            await client.start_vm(vm, timeout=0.1)
+        waited = time.monotonic() - started
+        return waited, await original, provider.calls
+
+    waited, result, calls = asyncio.run(main())
+    assert waited < 0.4
+    # the original is not affected by the duplicate giving up
+    assert result == "STARTING"
+    assert calls == ["start"]
+
+
+def test_action_pending_in_other_process_waits_no_longer_than_its_timeout(tmp_path):
+    path = str(tmp_path / "actions.db")
+    journal = SqliteActionJournal(path, ttl=60, poll_interval=0.05)
+    connection = sqlite3.connect(path, isolation_level=None)
+    try:
+        connection.execute("INSERT INTO actions (key, token, status, result, updated_at, pid) "
+                           "VALUES (?, 'token', 'pending', NULL, ?, ?)",
+                           ("SIMULATED/vm-1/start", time.time(), os.getpid() + 1))
+    finally:
+        connection.close()
+
+    provider = _Client(0)
+    started = time.monotonic()
+    with pytest.raises(iaas_ex.DeadlineExceeded):
+        asyncio.run(JournaledClient(provider, journal).start_vm(_vm(), timeout=0.2))
+    assert time.monotonic() - started < 1
+    assert provider.calls == []
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+
+import pytest
+
+from iaas import exceptions as iaas_ex
+from iaas.clients.netcup import NetcupClient
+from iaas.deadline import sleep
+
+
+class _FakeWebservice:
+    """ Answers the webservice calls of the client, each after a delay bounded by the per call timeout """
+
+    def __init__(self, vm_count: int, delay: float, slow: dict[str, float]):
+        self._vm_ids = [f"v{index}" for index in range(vm_count)]
+        self._delay = delay
+        self._slow = slow
+
+    async def call(self, service, operation, params, func, timeout=None, encode=None, decode=None):
+        if operation == "getVServers":
+            await sleep(self._slow.get("getVServers", self._delay), timeout)
+            return "<Envelope>" + "".join(f"<return>{vm_id}</return>" for vm_id in self._vm_ids) + "</Envelope>"
+
+        vm_id = params["vservername"]
+        await sleep(self._slow.get(vm_id, self._delay), timeout)
+        return (f"<Envelope><return><vServerNickname>{vm_id}</vServerNickname><status>online</status>"
+                f"<ips>10.0.0.1</ips></return></Envelope>")
+
+
+def _client(tmp_path, webservice: _FakeWebservice, timeout: float) -> NetcupClient:
+    path = tmp_path / "netcup.ini"
+    path.write_text(f"[DEFAULT]\nloginName=1\npassword=secret\ntimeout={timeout}\nmaxInFlight=5\n")
+    return NetcupClient(str(path), webservice)
+
+
+def test_per_call_timeout_skips_only_that_vm(tmp_path, caplog):
+    client = _client(tmp_path, _FakeWebservice(20, 0.02, {"v3": 10}), timeout=0.1)
+    with caplog.at_level(logging.WARNING):
+        vms = asyncio.run(client.get_all_vms())
+
+    assert sorted(vm.vm_id for vm in vms) == sorted(f"v{index}" for index in range(20) if index != 3)
+    assert "v3" in caplog.text
+
+
+def test_per_call_timeout_listing_servers_raises(tmp_path):
+    client = _client(tmp_path, _FakeWebservice(20, 0.02, {"getVServers": 10}), timeout=0.1)
+    with pytest.raises(iaas_ex.DeadlineExceeded):
+        asyncio.run(client.get_all_vms())
+
+
+def test_operation_deadline_returns_partial_list(tmp_path):
+    slow = {f"v{index}": 10 for index in range(10, 20)}
+    client = _client(tmp_path, _FakeWebservice(20, 0.02, slow), timeout=30)
+    vms = asyncio.run(client.get_all_vms(timeout=0.3))
+
+    assert sorted(vm.vm_id for vm in vms) == sorted(f"v{index}" for index in range(10))
+
+
+def test_operation_deadline_raises_without_partial(tmp_path):
+    slow = {f"v{index}": 10 for index in range(10, 20)}
+    client = _client(tmp_path, _FakeWebservice(20, 0.02, slow), timeout=30)
+    with pytest.raises(iaas_ex.DeadlineExceeded):
+        asyncio.run(client.get_all_vms(timeout=0.3, partial=False))
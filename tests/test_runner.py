@@ -0,0 +1,56 @@
+import asyncio
+import os
+
+from iaas.clients.simulated import SimulatedClient
+from iaas.enums import Providers
+from iaas.runner import ClientSpec, ShardedRunner, _run_shard_async, _ShardJob, shard_of
+from iaas.vm import VirtualMachine
+
+
+async def report_vm(vm: VirtualMachine, client) -> tuple[str, int]:
+    return vm.vm_id, os.getpid()
+
+
+def _spec(tmp_path) -> ClientSpec:
+    path = tmp_path / "simulated.ini"
+    path.write_text("[DEFAULT]\nfleetSize=25\npageSize=10\nlatency=0\nseed=1\n")
+    return ClientSpec(Providers.SIMULATED, "account-1", str(path))
+
+
+def _count_pages(monkeypatch) -> list[int]:
+    pages = []
+    list_page = SimulatedClient._list_page
+
+    def counting(self, *args, **kwargs):
+        pages.append(os.getpid())
+        return list_page(self, *args, **kwargs)
+
+    monkeypatch.setattr(SimulatedClient, "_list_page", counting)
+    return pages
+
+
+def test_fleet_is_listed_once_and_split_between_workers(tmp_path, monkeypatch):
+    pages = _count_pages(monkeypatch)
+    spec = _spec(tmp_path)
+    result = ShardedRunner([spec], report_vm, workers=3).run()
+
+    # three pages of ten, listed once by the coordinator whatever the number of workers
+    assert len(pages) == 3
+    assert result.errors == []
+    assert sorted(vm_id for vm_id, _ in result.results) == [f"sim-{index:06d}" for index in range(25)]
+    for vm_id, pid in result.results:
+        shard = shard_of(Providers.SIMULATED, "account-1", vm_id, 3)
+        assert result.shards[shard].pid == pid
+    assert result.vms == 25
+
+
+def test_worker_does_not_list(tmp_path, monkeypatch):
+    pages = _count_pages(monkeypatch)
+    spec = _spec(tmp_path)
+    vms = [VirtualMachine(display_name="vm", vm_id=f"sim-{index:06d}", state="RUNNING", provider=Providers.SIMULATED)
+           for index in range(5)]
+    shard_result = asyncio.run(_run_shard_async(_ShardJob(0, {spec: vms}, report_vm, 2)))
+
+    assert pages == []
+    assert [vm_id for vm_id, _ in shard_result.results] == [vm.vm_id for vm in vms]
+    assert shard_result.metrics.vms == 5
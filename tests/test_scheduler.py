@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from iaas import exceptions as iaas_ex
+from iaas.deadline import deadline
+from iaas.enums import Priority
+from iaas.scheduler import Scheduler
+
+
+async def _hold(release: asyncio.Event) -> None:
+    await release.wait()
+
+
+async def _fill(scheduler: Scheduler, count: int, release: asyncio.Event, key: str = "busy") -> list[asyncio.Task]:
+    """ Occupies slots with EMERGENCY calls so everything after them is queued """
+    tasks = [asyncio.create_task(scheduler.run(lambda: _hold(release), Priority.EMERGENCY, key))
+             for _ in range(count)]
+    await asyncio.sleep(0)
+    return tasks
+
+
+def test_runs_highest_priority_first():
+    async def main():
+        scheduler = Scheduler(max_concurrency=1, reserved_for_emergency=0)
+        release, order = asyncio.Event(), []
+        blockers = await _fill(scheduler, 1, release)
+
+        async def record(name: str) -> None:
+            order.append(name)
+
+        tasks = [asyncio.create_task(scheduler.run(lambda name=name: record(name), level))
+                 for name, level in [("background", Priority.BACKGROUND), ("user", Priority.USER),
+                                     ("emergency", Priority.EMERGENCY)]]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(*blockers, *tasks)
+        return order
+
+    assert asyncio.run(main()) == ["emergency", "user", "background"]
+
+
+def test_shares_round_robin_across_keys():
+    async def main():
+        scheduler = Scheduler(max_concurrency=1, reserved_for_emergency=0)
+        release, order = asyncio.Event(), []
+        blockers = await _fill(scheduler, 1, release)
+
+        async def record(key: str) -> None:
+            order.append(key)
+
+        tasks = [asyncio.create_task(scheduler.run(lambda key=key: record(key), Priority.USER, key))
+                 for key in ["a", "a", "a", "b", "b", "c"]]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(*blockers, *tasks)
+        return order
+
+    assert asyncio.run(main()) == ["a", "b", "c", "a", "b", "a"]
+
+
+def test_cancelled_while_queued_is_removed():
+    async def main():
+        scheduler = Scheduler(max_concurrency=1, reserved_for_emergency=0)
+        release, ran = asyncio.Event(), []
+        blockers = await _fill(scheduler, 1, release)
+
+        async def record(name: str) -> None:
+            ran.append(name)
+
+        cancelled = asyncio.create_task(scheduler.run(lambda: record("cancelled")))
+        queued = asyncio.create_task(scheduler.run(lambda: record("queued")))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        queued_count = scheduler.stats().queued[Priority.USER]
+
+        release.set()
+        await asyncio.gather(*blockers, queued)
+        return cancelled.cancelled(), queued_count, ran, scheduler.stats()
+
+    cancelled, queued_count, ran, stats = asyncio.run(main())
+    assert cancelled
+    assert queued_count == 1
+    assert ran == ["queued"]
+    assert stats.running == 0
+    assert stats.queued[Priority.USER] == 0
+
+
+def test_deadline_reached_while_queued():
+    async def main():
+        scheduler = Scheduler(max_concurrency=2, reserved_for_emergency=1)
+        release = asyncio.Event()
+        blockers = await _fill(scheduler, 1, release)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        with pytest.raises(iaas_ex.DeadlineExceeded):
+            with deadline(0.2):
+                await scheduler.run(lambda: asyncio.sleep(0), Priority.USER)
+        waited = loop.time() - started
+        stats = scheduler.stats()
+
+        release.set()
+        await asyncio.gather(*blockers)
+        return waited, stats
+
+    waited, stats = asyncio.run(main())
+    assert waited < 0.5
+    assert stats.queued[Priority.USER] == 0
+    assert stats.running == 1
+
+
+def test_slot_granted_as_deadline_is_reached_is_released(monkeypatch):
+    async def granted_then_timed_out(future, timeout):
+        # wait_for on Python 3.12+ can raise TimeoutError although the future got its result in the same iteration
+        await future
+        raise asyncio.TimeoutError
+
+    async def main():
+        scheduler = Scheduler(max_concurrency=1, reserved_for_emergency=0)
+        with monkeypatch.context() as patch:
+            patch.setattr(asyncio, "wait_for", granted_then_timed_out)
+            with pytest.raises(iaas_ex.DeadlineExceeded):
+                with deadline(0.1):
+                    await scheduler.run(lambda: asyncio.sleep(0))
+
+        running = scheduler.stats().running
+        result = await asyncio.wait_for(scheduler.run(lambda: asyncio.sleep(0, "ran")), 1)
+        return running, result
+
+    assert asyncio.run(main()) == (0, "ran")
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from iaas import exceptions as iaas_ex
+from iaas.clients.simulated import SimulatedClient
+from iaas.scheduler import ScheduledTransport, Scheduler
+from iaas.transport import RecordingTransport, ReplayTransport
+
+
+def _config(tmp_path, **options) -> str:
+    settings = {"fleetSize": 25, "pageSize": 10, "latency": 0.01, "seed": 1, "stoppedRatio": 0.5, "startDelay": 0}
+    settings.update(options)
+    path = tmp_path / "simulated.ini"
+    path.write_text("[DEFAULT]\n" + "".join(f"{option}={value}\n" for option, value in settings.items()))
+    return str(path)
+
+
+def test_record_then_replay(tmp_path):
+    config, cassette = _config(tmp_path), str(tmp_path / "cassette.ndjson")
+
+    async def record():
+        recorder = RecordingTransport(cassette)
+        client = SimulatedClient(config, recorder)
+        vms = await client.get_all_vms()
+        stopped = next(vm for vm in vms if vm.state == "STOPPED")
+        result = await client.start_vm(stopped)
+        recorder.close()
+        return vms, stopped, result
+
+    async def replay(stopped):
+        # a different seed gives a different fleet, so matching VMs can only come from the cassette
+        client = SimulatedClient(_config(tmp_path, seed=2), ReplayTransport(cassette, latency_scale=0))
+        return await client.get_all_vms(), await client.start_vm(stopped)
+
+    vms, stopped, result = asyncio.run(record())
+    replayed_vms, replayed_result = asyncio.run(replay(stopped))
+    assert len(vms) == 25
+    assert replayed_vms == vms
+    assert replayed_result == result == "STARTING"
+
+
+def test_calls_go_through_the_scheduler(tmp_path):
+    async def main():
+        scheduler = Scheduler(max_concurrency=2, reserved_for_emergency=0)
+        client = SimulatedClient(_config(tmp_path), ScheduledTransport(scheduler, "simulated"))
+        vms = await client.get_all_vms()
+        return vms, scheduler.stats()
+
+    vms, stats = asyncio.run(main())
+    assert len(vms) == 25
+    assert stats.completed == 3
+
+
+def test_per_call_timeout(tmp_path):
+    client = SimulatedClient(_config(tmp_path, latency=1, timeout=0.05))
+    with pytest.raises(iaas_ex.DeadlineExceeded):
+        asyncio.run(client.get_all_vms(partial=False))